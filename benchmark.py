@@ -0,0 +1,176 @@
+import argparse
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from time import perf_counter, sleep
+
+import numpy as np
+import torch
+
+from check import check_batch
+
+# Latency histogram bins in milliseconds, log spaced from 1ms to 100s
+HISTOGRAM_BINS = np.logspace(0, 5, 51)
+# Input length buckets in characters, for latency against input length
+LENGTH_BINS = [0, 16, 32, 64, 128, 10 ** 9]
+
+
+def make_requests(sentences, batch_size):
+    """ Groups the corpus into requests of batch_size sentences. """
+    return [sentences[i:i + batch_size] for i in range(0, len(sentences) - batch_size + 1, batch_size)]
+
+
+def send(request):
+    """ Checks one request through the in-process checker, using the same batched path for every batch size. """
+    check_batch(request)
+
+
+def run_closed_loop(requests, concurrency, num_requests):
+    """
+    Keeps concurrency requests in flight at all times until num_requests are done.
+    Returns (latency in seconds, number of characters) for every request, and the wall time.
+    """
+    results = []
+    source = cycle(requests)
+    lock = threading.Lock()
+    remaining = [num_requests]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+                request = next(source)
+            begin = perf_counter()
+            send(request)
+            results.append((perf_counter() - begin, sum(map(len, request))))
+
+    start = perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, perf_counter() - start
+
+
+def run_open_loop(requests, rate, num_requests, max_workers):
+    """
+    Sends requests at a fixed rate, whether or not earlier ones have finished. Latency is measured from the time each
+    request was due to be sent, so that queueing delay is included when the checker can't keep up.
+    Returns (latency in seconds, number of characters) for every request, and the wall time.
+    """
+    results = []
+
+    def timed(request, scheduled):
+        send(request)
+        results.append((perf_counter() - scheduled, sum(map(len, request))))
+
+    source = cycle(requests)
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i in range(num_requests):
+            scheduled = start + i / rate
+            delay = scheduled - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            executor.submit(timed, next(source), scheduled)
+    return results, perf_counter() - start
+
+
+def summarise(results, wall_time, batch_size, config):
+    """ Latency percentiles, histograms and throughput for one configuration. """
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    lengths = np.array([length for _, length in results]) / batch_size
+    summary = dict(config)
+    summary.update({
+        'requests': len(results),
+        'sentences_per_second': len(results) * batch_size / wall_time,
+        'requests_per_second': len(results) / wall_time,
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'histogram_bins_ms': HISTOGRAM_BINS.tolist(),
+        'histogram': np.histogram(latencies, bins=HISTOGRAM_BINS)[0].tolist(),
+    })
+
+    # Latency by the average characters per sentence in the request
+    by_length = {}
+    bucket_of_request = np.digitize(lengths, LENGTH_BINS) - 1
+    for bucket, (low, high) in enumerate(zip(LENGTH_BINS[:-1], LENGTH_BINS[1:])):
+        selected = latencies[bucket_of_request == bucket]
+        if len(selected):
+            by_length[f'{low}-{high - 1 if high < 10 ** 9 else ""}'] = {
+                'requests': len(selected),
+                'p50_ms': float(np.percentile(selected, 50)),
+                'p99_ms': float(np.percentile(selected, 99)),
+            }
+    summary['by_input_length'] = by_length
+    return summary
+
+
+def print_table(summaries):
+    """ Prints one row per configuration. """
+    print(f'{"mode":<8}{"load":>6}{"batch":>7}{"threads":>9}{"req":>7}{"sent/s":>10}'
+          f'{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+    for s in summaries:
+        load = s['concurrency'] if s['mode'] == 'closed' else s['rate']
+        print(f'{s["mode"]:<8}{load:>6}{s["batch_size"]:>7}{s["torch_threads"]:>9}{s["requests"]:>7}'
+              f'{s["sentences_per_second"]:>10.1f}{s["p50_ms"]:>10.1f}{s["p90_ms"]:>10.1f}{s["p99_ms"]:>10.1f}'
+              f'{s["max_ms"]:>10.1f}')
+
+
+def parse_list(value, cast=int):
+    return [cast(x) for x in value.split(',')] if value else []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the checker: latency and throughput per configuration.')
+    parser.add_argument('corpus', help='file of sentences to replay, one per line')
+    parser.add_argument('--concurrency', default='1,4', help='comma separated closed loop concurrency levels')
+    parser.add_argument('--rates', default='', help='comma separated open loop request rates, in requests/s')
+    parser.add_argument('--batch-sizes', default='1', help='comma separated numbers of sentences per request')
+    parser.add_argument('--torch-threads', default=str(torch.get_num_threads()),
+                        help='comma separated torch intra-op thread counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests measured per configuration')
+    parser.add_argument('--warmup', type=int, default=10, help='requests sent before measuring each configuration')
+    parser.add_argument('--max-workers', type=int, default=64, help='threads available to the open loop mode')
+    parser.add_argument('--output', default='benchmark-report.json', help='file that the JSON report is written to')
+    args = parser.parse_args()
+
+    with open(args.corpus, 'r') as r:
+        corpus = [line.strip() for line in r if line.strip()]
+    if len(corpus) < max(parse_list(args.batch_sizes)):
+        parser.error(f'{args.corpus} has {len(corpus)} sentences, fewer than the largest batch size '
+                     f'{max(parse_list(args.batch_sizes))}.')
+
+    summaries = []
+    for torch_threads in parse_list(args.torch_threads):
+        torch.set_num_threads(torch_threads)
+        for batch_size in parse_list(args.batch_sizes):
+            requests = make_requests(corpus, batch_size)
+            for _ in range(args.warmup):
+                send(requests[0])
+
+            for concurrency in parse_list(args.concurrency):
+                results, wall_time = run_closed_loop(requests, concurrency, args.requests)
+                summaries.append(summarise(results, wall_time, batch_size, {
+                    'mode': 'closed', 'concurrency': concurrency, 'rate': None,
+                    'batch_size': batch_size, 'torch_threads': torch_threads}))
+                print_table(summaries[-1:])
+            for rate in parse_list(args.rates, float):
+                results, wall_time = run_open_loop(requests, rate, args.requests, args.max_workers)
+                summaries.append(summarise(results, wall_time, batch_size, {
+                    'mode': 'open', 'concurrency': None, 'rate': rate,
+                    'batch_size': batch_size, 'torch_threads': torch_threads}))
+                print_table(summaries[-1:])
+
+    print()
+    print_table(summaries)
+    with open(args.output, 'w') as w:
+        json.dump({'corpus': args.corpus, 'configurations': summaries}, w, indent=1)
+    print(f'\nReport written to {args.output}.')
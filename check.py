@@ -1,14 +1,101 @@
+import argparse
+import json
+import os
 import sys
-try:
-    sys.argv[1]
-except IndexError:
-    print('Please provide an input sentence after "python check.py "')
-    exit()
+import warnings
 
 import numpy as np
-from transformers import AutoModelForTokenClassification, BertJapaneseTokenizer
+import torch
+from transformers import AutoConfig, AutoModelForTokenClassification, BertJapaneseTokenizer
 
-model = AutoModelForTokenClassification.from_pretrained('bunpo-check', num_labels=3)
+# Set to a directory written by `python check.py --export-mmap DIR` to share the weights between worker processes
+MMAP_PATH = os.environ.get('BUNPO_CHECK_MMAP')
+MMAP_ALIGNMENT = 64
+
+
+def export_mmap(model, path):
+    """
+    Saves the model config, plus every weight in one flat weights.bin file and its index.json, which load_mmap() can
+    memory map. Every process that maps the same file shares the same read-only physical pages.
+    """
+    os.makedirs(path, exist_ok=True)
+    model.config.save_pretrained(path)
+    index = {}
+    offset = 0
+    with open(os.path.join(path, 'weights.bin'), 'wb') as w:
+        for name, tensor in model.state_dict().items():
+            array = tensor.detach().cpu().numpy()
+            padding = -offset % MMAP_ALIGNMENT
+            w.write(b'\0' * padding)
+            offset += padding
+            index[name] = {'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+            w.write(array.tobytes())
+            offset += array.nbytes
+    with open(os.path.join(path, 'index.json'), 'w') as w:
+        json.dump(index, w)
+
+
+def load_mmap(path):
+    """
+    Builds the model from an export_mmap() directory, with every weight backed by the memory mapped file. Raises a
+    ValueError if the index doesn't have exactly the parameters and buffers of the model, with the same shapes.
+    """
+    config = AutoConfig.from_pretrained(path)
+    model = AutoModelForTokenClassification.from_config(config)
+    with open(os.path.join(path, 'index.json'), 'r') as r:
+        index = json.load(r)
+    weights = np.memmap(os.path.join(path, 'weights.bin'), dtype=np.uint8, mode='r')
+
+    # Anything left out of the index would silently keep its random initialisation
+    expected = {name: list(tensor.shape) for name, tensor in model.state_dict().items()}
+    missing = sorted(set(expected) - set(index))
+    unexpected = sorted(set(index) - set(expected))
+    if missing or unexpected:
+        raise ValueError(f'{path}/index.json does not match the model: missing {missing}, unexpected {unexpected}.')
+    mismatched = [name for name, entry in index.items() if entry['shape'] != expected[name]]
+    if mismatched:
+        raise ValueError(f'{path}/index.json has the wrong shape for {mismatched}.')
+
+    for name, entry in index.items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        array = weights[entry['offset']:entry['offset'] + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+        with warnings.catch_warnings():
+            # The weights are read-only, which torch warns about, but inference never writes to them
+            warnings.simplefilter('ignore')
+            tensor = torch.from_numpy(array)
+
+        module_name, _, attribute = name.rpartition('.')
+        module = model
+        for part in module_name.split('.') if module_name else []:
+            module = getattr(module, part)
+        if attribute in module._parameters:
+            module._parameters[attribute] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[attribute] = tensor
+    return model.eval()
+
+
+def memory_report():
+    """ Returns the memory use of this process in kB from /proc: rss, pss, shared and unique (private) memory. """
+    fields = {}
+    with open('/proc/self/smaps_rollup', 'r') as r:
+        for line in r:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'unique': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+if MMAP_PATH:
+    model = load_mmap(MMAP_PATH)
+else:
+    model = AutoModelForTokenClassification.from_pretrained('bunpo-check', num_labels=3)
 tokenizer = BertJapaneseTokenizer.from_pretrained('cl-tohoku/bert-base-japanese-whole-word-masking')
 
 
@@ -37,6 +124,23 @@ def check_string(string):
     return detokens, predictions
 
 
+def forward_batch(strings):
+    """ Passes a list of strings through the model in one batch, returns input_ids and logits as arrays. """
+    encoding = encode(strings)
+    with torch.no_grad():
+        output = model(
+            encoding['input_ids'],
+            encoding['attention_mask']
+        ).logits.cpu().numpy()
+    return encoding['input_ids'].numpy(), output
+
+
+def check_batch(strings):
+    """ Passes a list of strings through the model in one batch, returns input_ids and predictions as arrays. """
+    input_ids, output = forward_batch(strings)
+    return input_ids, np.argmax(output, axis=2)
+
+
 def check_and_print(string):
     """ Check a string and print the output for each token. """
     detoks, preds = check_string(string)
@@ -47,5 +151,49 @@ def check_and_print(string):
         print(f'{d:<8}| {p}')
 
 
-sentence = sys.argv[1]
-check_and_print(sentence)
+def profile_checks(path, num_sentences, mode, memory, report_path):
+    """ Check the first num_sentences lines of a file under the profiler and write the report grouped by subsystem. """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'permut8r'))
+    from profiler import Profiler
+
+    with open(path, 'r') as r:
+        sentences = [line.strip() for line in r if line.strip()][:num_sentences]
+
+    with Profiler(mode=mode, memory=memory) as profiler:
+        for sentence in sentences:
+            check_string(sentence)
+
+    print(profiler.write(report_path, units=len(sentences), unit_name='sentences'))
+    print(f'Profile report written to {report_path}.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check a Japanese sentence for grammatical errors.')
+    parser.add_argument('sentence', nargs='?', help='the sentence to check')
+    parser.add_argument('--profile', metavar='FILE', help='profile checking of the sentences in FILE, one per line')
+    parser.add_argument('--profile-sentences', type=int, default=100, help='the number of sentences to profile')
+    parser.add_argument('--profile-mode', choices=['cprofile', 'sample'], default='cprofile',
+                        help='deterministic cProfile, or the lower overhead sampling profiler')
+    parser.add_argument('--profile-report', default='profile-report.txt', help='file that the profile report is written to')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='skip allocation tracing while profiling')
+    parser.add_argument('--export-mmap', metavar='DIR',
+                        help='save the weights in a memory mappable format to DIR, for use with BUNPO_CHECK_MMAP=DIR')
+    parser.add_argument('--memory', action='store_true', help='print the memory use of this process after checking')
+    args = parser.parse_args()
+
+    if args.export_mmap:
+        export_mmap(model, args.export_mmap)
+        print(f'Memory mappable weights written to {args.export_mmap}. '
+              f'Set BUNPO_CHECK_MMAP={args.export_mmap} to load them.')
+    elif args.profile:
+        profile_checks(args.profile, args.profile_sentences, args.profile_mode, not args.no_tracemalloc,
+                       args.profile_report)
+    elif args.sentence is None:
+        print('Please provide an input sentence after "python check.py "')
+    else:
+        check_and_print(args.sentence)
+
+    if args.memory:
+        report = memory_report()
+        print(f'Memory (weights {"memory mapped from " + MMAP_PATH if MMAP_PATH else "loaded privately"}): '
+              + ', '.join(f'{key} {value / 1024:.1f} MiB' for key, value in report.items()))
@@ -0,0 +1,164 @@
+import argparse
+import json
+from time import perf_counter
+
+import numpy as np
+
+from check import check_batch
+
+LABEL_NAMES = ['unimportant', 'correct', 'error']
+
+
+def read_batches(path, batch_size, max_tok_length=48, limit=None):
+    """
+    Reads a labeled file in the generator's `sentence,labels` format in batches.
+
+    Yields:
+    ------
+    sentences: list:
+        the sentences in the batch
+    labels: np.ndarray:
+        uint8 array of shape (batch, max_tok_length) with the 0/1/2 label of every token
+    """
+    sentences, labels = [], []
+    count = 0
+    with open(path, 'r') as r:
+        for line in r:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            # Commas are replaced with 、 by the generator, so the last comma always separates the label
+            sentence, label = line.rsplit(',', 1)
+            sentences.append(sentence)
+            labels.append(label[:max_tok_length].ljust(max_tok_length, '0'))
+            count += 1
+
+            if len(sentences) == batch_size or count == limit:
+                yield sentences, np.frombuffer(''.join(labels).encode(), dtype=np.uint8).reshape(-1, max_tok_length) - ord('0')
+                sentences, labels = [], []
+            if count == limit:
+                return
+    if sentences:
+        yield sentences, np.frombuffer(''.join(labels).encode(), dtype=np.uint8).reshape(-1, max_tok_length) - ord('0')
+
+
+def confusion_matrix(labels, predictions, num_labels=3):
+    """ Returns a (num_labels, num_labels) matrix of counts, with true labels as rows and predictions as columns. """
+    return np.bincount(
+        (labels.astype(np.int64) * num_labels + predictions).ravel(), minlength=num_labels ** 2
+    ).reshape(num_labels, num_labels)
+
+
+def precision_recall_fbeta(tp, fp, fn, beta=0.5):
+    """ Precision, recall and F-beta from true positive, false positive and false negative counts. """
+    precision = tp / (tp + fp) if tp + fp else 0.
+    recall = tp / (tp + fn) if tp + fn else 0.
+    denominator = beta ** 2 * precision + recall
+    fbeta = (1 + beta ** 2) * precision * recall / denominator if denominator else 0.
+    return precision, recall, fbeta
+
+
+def error_scores(confusion):
+    """ Scores the error label (2) as the positive class, over the valid (non-0 labeled) tokens. """
+    tp = confusion[2, 2]
+    fp = confusion[1, 2]
+    fn = confusion[2, 0] + confusion[2, 1]
+    return precision_recall_fbeta(tp, fp, fn)
+
+
+def evaluate(path, batch_size=256, limit=None):
+    """
+    Runs batched inference on a labeled file, returns token and sentence level scores, and throughput.
+
+    Params:
+    ------
+    path: str:
+        a file in the generator's `sentence,labels` format
+    batch_size: int:
+        the number of sentences passed through the model at once
+    limit: int or None:
+        the maximum number of sentences to evaluate
+
+    Returns:
+    -------
+    results: dict:
+        the scores, confusion matrices and throughput numbers
+    """
+    token_confusion = np.zeros((3, 3), dtype=np.int64)
+    sentence_confusion = np.zeros((2, 2), dtype=np.int64)
+    num_sentences = num_tokens = 0
+    model_time = 0.
+    start = perf_counter()
+
+    for sentences, labels in read_batches(path, batch_size, limit=limit):
+        batch_start = perf_counter()
+        _, predictions = check_batch(sentences)
+        model_time += perf_counter() - batch_start
+
+        # Predictions on tokens labelled 0 (CLS, SEP, PAD) are unimportant, so mask them to 0 as well
+        valid = labels != 0
+        predictions = np.where(valid, predictions, 0)
+        token_confusion += confusion_matrix(labels, predictions)
+
+        # A sentence is positive if any of its tokens is an error
+        sentence_labels = (labels == 2).any(axis=1).astype(np.int64)
+        sentence_predictions = (predictions == 2).any(axis=1).astype(np.int64)
+        sentence_confusion += confusion_matrix(sentence_labels, sentence_predictions, num_labels=2)
+
+        num_sentences += len(sentences)
+        num_tokens += int(valid.sum())
+
+    total_time = perf_counter() - start
+    token_precision, token_recall, token_f05 = error_scores(token_confusion)
+    sentence_precision, sentence_recall, sentence_f05 = precision_recall_fbeta(
+        sentence_confusion[1, 1], sentence_confusion[0, 1], sentence_confusion[1, 0])
+
+    return {
+        'sentences': num_sentences,
+        'tokens': num_tokens,
+        'token': {'precision': token_precision, 'recall': token_recall, 'f0.5': token_f05,
+                  'confusion': token_confusion.tolist()},
+        'sentence': {'precision': sentence_precision, 'recall': sentence_recall, 'f0.5': sentence_f05,
+                     'confusion': sentence_confusion.tolist()},
+        'seconds': total_time,
+        'model_seconds': model_time,
+        'sentences_per_second': num_sentences / total_time if total_time else 0.,
+        'tokens_per_second': num_tokens / total_time if total_time else 0.,
+    }
+
+
+def print_results(results):
+    """ Print the scores, confusion matrices and throughput. """
+    print(f'Evaluated {results["sentences"]:,} sentences ({results["tokens"]:,} valid tokens).')
+    print(f'{"":<10}{"precision":>10}{"recall":>10}{"F0.5":>10}')
+    for level in ('token', 'sentence'):
+        scores = results[level]
+        print(f'{level:<10}{100 * scores["precision"]:>10.1f}{100 * scores["recall"]:>10.1f}{100 * scores["f0.5"]:>10.1f}')
+
+    print('\nToken confusion matrix (rows: label, columns: prediction)')
+    print(f'{"":<13}' + ''.join(f'{name:>13}' for name in LABEL_NAMES))
+    for name, row in zip(LABEL_NAMES, results['token']['confusion']):
+        print(f'{name:<13}' + ''.join(f'{count:>13,}' for count in row))
+
+    print('\nSentence confusion matrix (rows: label, columns: prediction)')
+    print(f'{"":<13}{"no error":>13}{"error":>13}')
+    for name, row in zip(['no error', 'error'], results['sentence']['confusion']):
+        print(f'{name:<13}' + ''.join(f'{count:>13,}' for count in row))
+
+    print(f'\nTook {results["seconds"]:.1f}s ({results["model_seconds"]:.1f}s in the model): '
+          f'{results["sentences_per_second"]:.1f} sentences/s, {results["tokens_per_second"]:.1f} tokens/s.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score the model on a labeled test set in the sentence,labels format.')
+    parser.add_argument('path', help='the labeled test set')
+    parser.add_argument('--batch-size', type=int, default=256, help='the number of sentences per forward pass')
+    parser.add_argument('--limit', type=int, help='only evaluate the first LIMIT sentences')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = evaluate(args.path, args.batch_size, args.limit)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as w:
+            json.dump(results, w, indent=2)
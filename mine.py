@@ -0,0 +1,159 @@
+import argparse
+from time import perf_counter
+
+import numpy as np
+import torch
+
+from check import forward_batch
+
+
+def label_array(labels, max_tok_length):
+    """ Converts a list of label strings, padded to max_tok_length, into a uint8 array of 0/1/2 labels. """
+    return np.frombuffer(''.join(labels).encode(), dtype=np.uint8).reshape(-1, max_tok_length) - ord('0')
+
+
+def read_pairs(path, batch_size, max_tok_length=48, shard=0, num_shards=1):
+    """
+    Reads the output of permut8.py in batches of whole pairs: the correct line, then its permuted line. With
+    num_shards > 1, only every num_shards-th pair starting from pair number shard is read, so that several processes
+    can split a file and each still sees the same mix of correct and permuted lines.
+
+    Yields:
+    ------
+    sentences: list:
+        the sentences of the pairs in the batch, each correct line followed by its permuted line
+    labels: np.ndarray:
+        uint8 array of shape (2 * pairs, max_tok_length) with the 0/1/2 label of every token
+    """
+    sentences, labels = [], []
+    with open(path, 'r') as r:
+        lines = filter(None, (line.rstrip('\n') for line in r))
+        # Zipping the same iterator with itself takes the lines two at a time
+        for pair_no, pair in enumerate(zip(lines, lines)):
+            if pair_no % num_shards != shard:
+                continue
+            for line in pair:
+                # Commas are replaced with 、 by the generator, so the last comma always separates the label
+                sentence, label = line.rsplit(',', 1)
+                sentences.append(sentence)
+                labels.append(label[:max_tok_length].ljust(max_tok_length, '0'))
+
+            if len(sentences) == 2 * batch_size:
+                yield sentences, label_array(labels, max_tok_length)
+                sentences, labels = [], []
+    if sentences:
+        yield sentences, label_array(labels, max_tok_length)
+
+
+def score_batch(logits, labels):
+    """
+    Scores how hard each example is for the model.
+
+    Params:
+    ------
+    logits: np.ndarray:
+        model output of shape (batch, max_tok_length, 3)
+    labels: np.ndarray:
+        the 0/1/2 labels of shape (batch, max_tok_length)
+
+    Returns:
+    -------
+    loss: np.ndarray:
+        the mean cross entropy over the valid (non-0 labeled) tokens of each example
+    disagreement: np.ndarray:
+        the number of valid tokens where the predicted label differs from the true label
+    """
+    valid = labels != 0
+    log_probs = logits - np.logaddexp.reduce(logits, axis=2, keepdims=True)
+    token_loss = -np.take_along_axis(log_probs, labels[..., None].astype(np.int64), axis=2)[..., 0]
+    loss = (token_loss * valid).sum(axis=1) / np.maximum(1, valid.sum(axis=1))
+    disagreement = ((np.argmax(logits, axis=2) != labels) & valid).sum(axis=1)
+    return loss, disagreement
+
+
+def select(loss, disagreement, keep_ratio, random_ratio, by, rng):
+    """
+    Picks the examples to keep from a batch: the hardest keep_ratio of them by loss or disagreement, plus a random
+    random_ratio of the rest, so that the mined set doesn't lose easy examples entirely. Returns a boolean mask.
+    """
+    score = loss if by == 'loss' else disagreement + loss / (1 + loss.max())  # Break disagreement ties by loss
+    num_hard = int(np.ceil(keep_ratio * len(score)))
+    keep = np.zeros(len(score), dtype=bool)
+    keep[np.argsort(-score, kind='stable')[:num_hard]] = True
+    keep |= rng.uniform(size=len(score)) < random_ratio
+    return keep
+
+
+def mine(input_path, output_path, batch_size=256, keep_ratio=0.25, random_ratio=0.02, by='loss', shard=0,
+         num_shards=1, seed=None):
+    """
+    Streams candidate pairs from permut8.py through the model, and writes the hardest pairs to output_path in the same
+    format, correct line first. A pair is as hard as the harder of its two lines. Returns the number of pairs read and
+    kept.
+
+    Params:
+    ------
+    input_path: str:
+        output of permut8.py
+    output_path: str:
+        file that the kept examples are written to
+    batch_size: int:
+        the number of pairs (twice as many lines) passed through the model at once, selection is done per batch
+    keep_ratio: float:
+        the fraction of the pairs in each batch kept, hardest first
+    random_ratio: float:
+        the fraction of the remaining, easier pairs that are kept anyway
+    by: str:
+        'loss' to rank pairs by mean token loss, or 'disagreement' by the number of wrongly predicted tokens
+    shard: int:
+        which of num_shards interleaved parts of the input this process handles, split by pair
+    num_shards: int:
+        the number of processes the input is split between
+    seed: int or None:
+        seed for the random selection of easier examples
+    """
+    rng = np.random.default_rng(None if seed is None else [seed, shard])
+    num_read = num_kept = 0
+    start = perf_counter()
+
+    with open(output_path, 'w') as w:
+        for sentences, labels in read_pairs(input_path, batch_size, shard=shard, num_shards=num_shards):
+            _, logits = forward_batch(sentences)
+            loss, disagreement = score_batch(logits, labels)
+            # Score each pair by the harder of its two lines
+            keep = select(loss.reshape(-1, 2).max(axis=1), disagreement.reshape(-1, 2).max(axis=1), keep_ratio,
+                          random_ratio, by, rng)
+
+            label_strings = (labels + ord('0')).astype(np.uint8)
+            for pair in np.nonzero(keep)[0]:
+                for i in (2 * pair, 2 * pair + 1):
+                    w.write(f'{sentences[i]},{label_strings[i].tobytes().decode()}\n')
+
+            num_read += len(keep)
+            num_kept += int(keep.sum())
+            print(f'\rRead {num_read:,}, kept {num_kept:,} ({num_read / (perf_counter() - start):.1f} pairs/s)',
+                  end='', flush=True)
+    print()
+    return num_read, num_kept
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep the generated examples that the trained model finds hardest.')
+    parser.add_argument('input', help='candidate pairs written by permut8.py')
+    parser.add_argument('output', help='file that the kept examples are written to')
+    parser.add_argument('--batch-size', type=int, default=256, help='the number of pairs per forward pass')
+    parser.add_argument('--keep-ratio', type=float, default=0.25, help='the fraction of each batch kept, hardest first')
+    parser.add_argument('--random-ratio', type=float, default=0.02,
+                        help='the fraction of the remaining easier pairs kept anyway')
+    parser.add_argument('--by', choices=['loss', 'disagreement'], default='loss', help='how hardness is measured')
+    parser.add_argument('--shard', type=int, default=0, help='which part of the input this process handles, by pair')
+    parser.add_argument('--num-shards', type=int, default=1, help='the number of processes splitting the input')
+    parser.add_argument('--threads', type=int, help='torch threads for this process')
+    parser.add_argument('--seed', type=int, help='seed for the random selection of easier examples')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    read, kept = mine(args.input, args.output, args.batch_size, args.keep_ratio, args.random_ratio, args.by,
+                      args.shard, args.num_shards, args.seed)
+    print(f'Kept {kept:,} of {read:,} pairs ({100 * kept / max(1, read):.1f}%) in {args.output}.')
@@ -0,0 +1,139 @@
+import argparse
+import json
+from itertools import islice
+from multiprocessing import Pool
+from time import time
+
+import numpy as np
+
+# Sentence lengths in characters above this are counted in the last bin
+MAX_CHAR_LENGTH = 256
+
+
+def empty_stats(max_tok_length):
+    """ All the counters that are accumulated over the generator output, set to 0. """
+    return {
+        'pairs': np.zeros(1, dtype=np.int64),
+        'label_counts': np.zeros(3, dtype=np.int64),
+        'position_label_counts': np.zeros((max_tok_length, 3), dtype=np.int64),
+        'errors_per_line': np.zeros(max_tok_length + 1, dtype=np.int64),
+        'token_lengths': np.zeros(max_tok_length + 1, dtype=np.int64),
+        'char_lengths': np.zeros(MAX_CHAR_LENGTH + 1, dtype=np.int64),
+        # Inferred from the change in character length: deleted, same length (swaps, kanji/particle swaps), inserted
+        'length_change': np.zeros(3, dtype=np.int64),
+    }
+
+
+def analyse_chunk(lines, stats, max_tok_length):
+    """ Adds the counts for a chunk of output lines, which must start on a correct line and hold whole pairs. """
+    # Every line ends with ,<max_tok_length labels> so the labels can be sliced off without parsing
+    lines = [line.rstrip('\n') for line in lines]
+    labels = np.frombuffer(''.join([line[-max_tok_length:] for line in lines]).encode(), dtype=np.uint8)
+    labels = labels.reshape(-1, max_tok_length) - ord('0')
+    char_lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines)) - max_tok_length - 1
+
+    correct, permuted = labels[0::2], labels[1::2]
+    stats['pairs'] += len(permuted)
+    stats['label_counts'] += np.bincount(labels.ravel(), minlength=3)[:3]
+    for label in range(3):
+        stats['position_label_counts'][:, label] += (labels == label).sum(axis=0)
+    stats['errors_per_line'] += np.bincount((permuted == 2).sum(axis=1), minlength=max_tok_length + 1)
+    stats['token_lengths'] += np.bincount((correct != 0).sum(axis=1), minlength=max_tok_length + 1)
+    stats['char_lengths'] += np.bincount(np.minimum(char_lengths[0::2], MAX_CHAR_LENGTH), minlength=MAX_CHAR_LENGTH + 1)
+    stats['length_change'] += np.bincount(np.sign(char_lengths[1::2] - char_lengths[0::2]) + 1, minlength=3)
+
+
+def analyse_file(path, max_tok_length=48, chunk_lines=200_000):
+    """ Streams one output file in chunks of chunk_lines lines and returns its stats, so memory use stays bounded. """
+    stats = empty_stats(max_tok_length)
+    chunk_lines -= chunk_lines % 2  # Keep pairs together
+    with open(path, 'r') as r:
+        while True:
+            lines = list(islice(r, chunk_lines))
+            if not lines:
+                break
+            analyse_chunk(lines, stats, max_tok_length)
+    return stats
+
+
+def combine(all_stats):
+    """ Sums the stats of several files. """
+    total = all_stats[0]
+    for stats in all_stats[1:]:
+        for key, value in stats.items():
+            total[key] += value
+    return total
+
+
+def percentile(histogram, q):
+    """ The value at the q-th percentile of a histogram whose bins are the values 0, 1, 2, ... """
+    return int(np.searchsorted(np.cumsum(histogram), q / 100 * histogram.sum()))
+
+
+def describe(histogram):
+    """ Mean and percentiles of a histogram whose bins are the values 0, 1, 2, ... """
+    count = max(1, histogram.sum())
+    mean = (np.arange(len(histogram)) * histogram).sum() / count
+    return f'mean {mean:.2f}, p5 {percentile(histogram, 5)}, p50 {percentile(histogram, 50)}, ' \
+           f'p95 {percentile(histogram, 95)}, max {np.nonzero(histogram)[0].max() if histogram.any() else 0}'
+
+
+def report(stats):
+    """ Returns a text summary of the stats. """
+    pairs = int(stats['pairs'][0])
+    label_total = max(1, stats['label_counts'].sum())
+    valid_total = max(1, stats['label_counts'][1:].sum())
+    out = [f'Pairs: {pairs:,}', '', 'Label balance:']
+    for label, name in enumerate(['unimportant', 'correct', 'error']):
+        count = stats['label_counts'][label]
+        out.append(f'  {label} {name:<12}{count:>16,}{100 * count / label_total:>8.2f}% of all'
+                   + (f'{100 * count / valid_total:>8.2f}% of valid' if label else ''))
+
+    out.append('')
+    out.append(f'Errors per permuted line: {describe(stats["errors_per_line"])}')
+    for errors, count in enumerate(stats['errors_per_line'][:11]):
+        out.append(f'  {errors:>2}{count:>16,}{100 * count / max(1, pairs):>8.2f}%')
+
+    out.append('')
+    out.append(f'Valid tokens per correct line: {describe(stats["token_lengths"])}')
+    out.append(f'Characters per correct line: {describe(stats["char_lengths"])}')
+
+    out.append('')
+    out.append('Permutation mix (inferred from the change in character length of each pair):')
+    for name, count in zip(['shorter (deletions)', 'same length (swaps, substitutions)', 'longer (insertions)'],
+                           stats['length_change']):
+        out.append(f'  {name:<36}{count:>14,}{100 * count / max(1, pairs):>8.2f}%')
+
+    out.append('')
+    out.append('Error rate by token position (errors / valid tokens):')
+    position_counts = stats['position_label_counts']
+    error_rate = position_counts[:, 2] / np.maximum(1, position_counts[:, 1:].sum(axis=1))
+    for start in range(0, len(error_rate), 12):
+        out.append('  ' + ' '.join(f'{i:>2}:{100 * rate:>5.1f}%' for i, rate in
+                                   zip(range(start, start + 12), error_rate[start:start + 12])))
+    return '\n'.join(out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream statistics over the output of permut8.py.')
+    parser.add_argument('paths', nargs='+', help='output files or shards, analysed in parallel')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes, default one per CPU')
+    parser.add_argument('--chunk-lines', type=int, default=200_000, help='lines held in memory at once per process')
+    parser.add_argument('--output', help='also write the raw counts as JSON to this file')
+    args = parser.parse_args()
+
+    # ============ HYPERPARAMETERS ============
+    # The token length of the output sequences
+    max_tok_length = 48
+    # =========================================
+
+    start = time()
+    with Pool(args.processes) as pool:
+        results = pool.starmap(analyse_file, [(path, max_tok_length, args.chunk_lines) for path in args.paths])
+    stats = combine(results)
+
+    print(report(stats))
+    print(f'\nAnalysed {len(args.paths)} files in {time() - start:.1f} seconds.')
+    if args.output:
+        with open(args.output, 'w') as w:
+            json.dump({key: value.tolist() for key, value in stats.items()}, w)
@@ -0,0 +1,209 @@
+import argparse
+import multiprocessing
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from pipeline import TOKENIZER_NAME, Pipeline
+from prefilter import PreFilter
+
+
+def pretokenize(input_path, output_path, tokenizer, max_tok_length=48, prefilter=None, batch_size=4096):
+    """
+    Tokenizes a file of correct lines once, and saves the input_ids as a flat uint16 binary file that can be memory
+    mapped by the PermutationDataset. Returns the number of lines saved.
+
+    Params:
+    ------
+    input_path: str:
+        file of correct lines, one per line
+    output_path: str:
+        file that the input_ids are written to, as max_tok_length uint16 values per line
+    tokenizer: huggingface transformers pre-trained tokenizer object:
+        tokenizer object for converting strings into token lists
+    max_tok_length: int:
+        the token length of the output sequences
+    prefilter: PreFilter or None:
+        if given, lines that it rejects are not saved
+    batch_size: int:
+        the number of lines tokenized at once
+    """
+    if len(tokenizer) > np.iinfo(np.uint16).max:
+        raise ValueError(f'Vocabulary of {len(tokenizer)} tokens does not fit into uint16 input_ids.')
+
+    count = 0
+    with open(input_path, 'r', errors='ignore') as r, open(output_path, 'wb') as w:
+        batch = []
+        for line in r:
+            line = line.strip()
+            if prefilter is not None and not prefilter.accept(line):
+                continue
+            batch.append(line)
+
+            if len(batch) == batch_size:
+                tokens = tokenizer(batch, add_special_tokens=True, max_length=max_tok_length, padding='max_length',
+                                   truncation=True)['input_ids']
+                w.write(np.asarray(tokens, dtype=np.uint16).tobytes())
+                count += len(batch)
+                batch = []
+        if batch:
+            tokens = tokenizer(batch, add_special_tokens=True, max_length=max_tok_length, padding='max_length',
+                               truncation=True)['input_ids']
+            w.write(np.asarray(tokens, dtype=np.uint16).tobytes())
+            count += len(batch)
+    return count
+
+
+class PermutationDataset(IterableDataset):
+    """
+    Generates permuted training examples on the fly from pre-tokenized correct sentences, so that only the clean corpus
+    needs to be stored and every epoch sees fresh errors. Each sentence is permuted with a random number generator
+    seeded by (seed, epoch, index), so any example can be reproduced exactly with example(index, epoch).
+
+    Each worker process builds its own Pipeline (MeCab taggers and tokenizers can't be shared across processes) the
+    first time it iterates, and handles every num_workers-th sentence of the (optionally shuffled) order. The epoch is
+    kept in shared memory, so set_epoch() also reaches workers of a DataLoader with persistent_workers=True, as long as
+    it is called before iterating over the DataLoader for that epoch.
+
+    Yields dictionaries of input_ids, attention_mask and labels tensors: the correct sentence with labels of 0s and 1s,
+    followed by the permuted sentence with labels of 0s, 1s and 2s, just like the pairs written by permut8.py.
+    Sentences where no permutation was made are skipped, also as in permut8.py.
+
+    Params:
+    ------
+    ids_path: str:
+        the file written by pretokenize()
+    max_tok_length: int:
+        the token length of the sequences
+    no_perm_probability: float:
+        the probability that a token will be left unaltered
+    seed: int:
+        the base seed, combined with the epoch and the index of each sentence
+    shuffle: bool:
+        set to True to visit the sentences in a different random order every epoch
+    include_correct: bool:
+        set to False to only yield the permuted sentences
+    """
+    def __init__(self, ids_path, max_tok_length=48, no_perm_probability=6. / 7, seed=0, shuffle=True,
+                 include_correct=True):
+        """
+        Creates an instance of the PermutationDataset class.
+
+        Params:
+        ------
+        ids_path: str:
+            the file written by pretokenize()
+        max_tok_length: int:
+            the token length of the sequences
+        no_perm_probability: float:
+            the probability that a token will be left unaltered
+        seed: int:
+            the base seed, combined with the epoch and the index of each sentence
+        shuffle: bool:
+            set to True to visit the sentences in a different random order every epoch
+        include_correct: bool:
+            set to False to only yield the permuted sentences
+        """
+        super().__init__()
+        self.ids_path = ids_path
+        self.max_tok_length = max_tok_length
+        self.no_perm_probability = no_perm_probability
+        self.seed = seed
+        self.shuffle = shuffle
+        self.include_correct = include_correct
+        # Shared with the worker processes, which keep their own copy of everything else
+        self.shared_epoch = multiprocessing.Value('q', 0)
+
+        self.num_sentences = len(self.load_ids())
+        self.pipeline = None
+
+    def load_ids(self):
+        """ Memory maps the pre-tokenized sentences as a (num_sentences, max_tok_length) array. """
+        return np.memmap(self.ids_path, dtype=np.uint16, mode='r').reshape(-1, self.max_tok_length)
+
+    @property
+    def epoch(self):
+        return self.shared_epoch.value
+
+    def set_epoch(self, epoch):
+        """ Set the epoch, which changes the permutations (and order, if shuffling) of every sentence. """
+        self.shared_epoch.value = epoch
+
+    def get_pipeline(self):
+        """ Builds the pipeline in the current process the first time it is needed. """
+        if self.pipeline is None:
+            self.pipeline = Pipeline.from_defaults(np.random.default_rng(self.seed), self.max_tok_length,
+                                                   self.no_perm_probability, logging=False)
+        return self.pipeline
+
+    def get_order(self, epoch):
+        """ The order that sentences are visited in for an epoch. """
+        if not self.shuffle:
+            return np.arange(self.num_sentences)
+        return np.random.default_rng([self.seed, epoch]).permutation(self.num_sentences)
+
+    def to_example(self, tokens, label):
+        """ Converts a list of input_ids and a label list or string into a dictionary of tensors. """
+        input_ids = torch.tensor(tokens, dtype=torch.long)
+        return {
+            'input_ids': input_ids,
+            'attention_mask': (input_ids != 0).long(),
+            'labels': torch.tensor([int(x) for x in label], dtype=torch.long),
+        }
+
+    def permutate(self, ids, index, epoch):
+        """ Permutes the sentence at the given index for the epoch. Returns a list of 0, 1 or 2 examples. """
+        pipeline = self.get_pipeline()
+        pipeline.set_rng(np.random.default_rng([self.seed, epoch, int(index)]))
+
+        tokens = ids[index].tolist()
+        detokens = pipeline.vocab.detokens(tokens)
+        num_valid_tokens = pipeline.vocab.count_valid(tokens)
+        line = pipeline.reconstructor.toks_to_line(detokens[1:1 + num_valid_tokens])
+
+        status, pair = pipeline.permutate_tokens(line, tokens)
+        if status != Pipeline.WRITTEN:
+            return []
+
+        _, corr_label, new_line, new_label = pair
+        examples = [self.to_example(pipeline.encode(new_line)['input_ids'], new_label)]
+        if self.include_correct:
+            examples.insert(0, self.to_example(tokens, corr_label))
+        return examples
+
+    def example(self, index, epoch=None):
+        """ Reproduce the examples generated for the sentence at the given index in an epoch (default: current). """
+        return self.permutate(self.load_ids(), index, self.epoch if epoch is None else epoch)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+
+        ids = self.load_ids()
+        epoch = self.epoch
+        for index in self.get_order(epoch)[worker_id::num_workers]:
+            for example in self.permutate(ids, index, epoch):
+                yield example
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-tokenize correct lines for the PermutationDataset.')
+    parser.add_argument('--input', default='./testing.txt', help='file of correct lines, one per line')
+    parser.add_argument('--output', default='testing.ids', help='file that the uint16 input_ids are written to')
+    parser.add_argument('--no-prefilter', action='store_true', help='keep every line, however useless')
+    args = parser.parse_args()
+
+    # ============ HYPERPARAMETERS ============
+    # The token length of the output sequences
+    max_tok_length = 48
+    # =========================================
+
+    from transformers import BertJapaneseTokenizer
+
+    tokenizer = BertJapaneseTokenizer.from_pretrained(TOKENIZER_NAME)
+    prefilter = None if args.no_prefilter else PreFilter(logging=False)
+    count = pretokenize(args.input, args.output, tokenizer, max_tok_length, prefilter)
+    print(f'Saved {count:,} pre-tokenized lines to {args.output}.')
+    if prefilter is not None:
+        print(prefilter.report())
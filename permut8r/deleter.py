@@ -40,6 +40,7 @@ class Deleter:
         ------
         detokens: list:
             the current token-split list of strings, obtained from converting the tokenized sentence back into characters
+            with the pipeline's VocabTable, so already cleaned of #
         err_label: list:
             the current list of 0, 1 and 2 labels assigned to each token
         index: int:
@@ -54,7 +55,7 @@ class Deleter:
         err_label: list:
             the updated list of 0, 1 and 2 labels assigned to each token
         """
-        isolated_detoken = detokens[index].replace('#', '')
+        isolated_detoken = detokens[index]
 
         if len(isolated_detoken) == 0:
             print(f'Detoken {isolated_detoken} at {index} had length 0 and so returning. Full detokens: {detokens}')
@@ -0,0 +1,156 @@
+class Eligibility:
+    """
+    Classifies detokens once (results are cached by cleaned detoken string) and draws the index to permute only from
+    positions where the chosen permutation can actually do something. Without this, many rolls are wasted, eg. KANJI
+    drawn for a katakana token, DELETE drawn for the EOS punctuation, or SWAP drawn for two identical neighbouring
+    tokens. A SWAP is drawn together with the neighbour to swap with, so it is never spent on an identical neighbour.
+
+    Classes, stored as bit flags:
+    EMPTY: the detoken is empty
+    KATAKANA: the detoken is fully katakana
+    PARTICLE: the detoken is a single particle that the KanjiKing can swap
+    PUNCTUATION: the detoken is EOS punctuation, which the Deleter will not delete
+    KANJI: the detoken contains at least one kanji
+    HOMONYMS: the detoken contains at least one kanji that shares a reading with another kanji in the dictionary, or
+    is a word in the homophone index
+
+    Params:
+    ------
+    rng: numpy default_rng() object:
+        random number generator that is shared across all the permutators
+    vocab: VocabTable:
+        the cleaned strings and script classes of every token id, which the cache is filled from up front
+    kanji_dictionary: dict:
+        a dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字)
+    particles_short: str:
+        the particles that the KanjiKing swaps for one another
+    homophones: HomophoneIndex or None:
+        the word-level homophone index used by the KanjiKing, if any
+    logging: bool:
+        set to True to print logs for every step of the process
+    """
+    EMPTY = 1
+    KATAKANA = 2
+    PARTICLE = 4
+    PUNCTUATION = 8
+    KANJI = 16
+    HOMONYMS = 32
+
+    def __init__(self, rng, vocab, kanji_dictionary, particles_short, homophones=None, logging=True):
+        """
+        Creates an instance of the Eligibility class.
+
+        Params:
+        ------
+        rng: numpy default_rng() object:
+            random number generator that is shared across all the permutators
+        vocab: VocabTable:
+            the cleaned strings and script classes of every token id, which the cache is filled from up front
+        kanji_dictionary: dict:
+            a dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字)
+        particles_short: str:
+            the particles that the KanjiKing swaps for one another
+        homophones: HomophoneIndex or None:
+            the word-level homophone index used by the KanjiKing, if any
+        logging: bool:
+            set to True to print logs for every step of the process
+        """
+        self.rng = rng
+        self.vocab = vocab
+        self.particles_short = particles_short
+        self.homophones = homophones
+        self.logging = logging
+
+        # Every kanji that has at least one other kanji with the same reading
+        self.homonym_kanji = set()
+        for homonyms in kanji_dictionary.values():
+            if len(homonyms) > 1:
+                self.homonym_kanji.update(homonyms)
+
+        # Every token in the vocabulary is classified once, from its script class
+        self.cache = {}
+        for detoken, script in zip(vocab.cleaned, vocab.script):
+            self.cache[detoken] = self.get_flags(detoken, script)
+        self.no_eligible = 0  # Count of rolls that were lost because their ticket had no eligible position
+
+    def get_flags(self, detoken, script):
+        """ Returns the bit flags for a cleaned detoken with the given script class. """
+        if len(detoken) == 0:
+            return self.EMPTY
+
+        flags = 0
+        if script == self.vocab.KATAKANA:
+            flags |= self.KATAKANA
+        if detoken in self.particles_short and len(detoken) == 1:
+            flags |= self.PARTICLE
+        if detoken in '。！？!?.':
+            flags |= self.PUNCTUATION
+        if script & self.vocab.KANJI:
+            flags |= self.KANJI
+        if any([x in self.homonym_kanji for x in detoken]) \
+                or (self.homophones is not None and detoken in self.homophones):
+            flags |= self.HOMONYMS
+        return flags
+
+    def classify(self, detoken):
+        """ Returns the bit flags for a single cleaned detoken. Detokens that a permutation changed are cached too. """
+        try:
+            return self.cache[detoken]
+        except KeyError:
+            flags = self.cache[detoken] = self.get_flags(detoken, self.vocab.script_of(detoken))
+            return flags
+
+    def is_eligible(self, ticket, flags):
+        """ Whether a detoken with the given flags can be permuted by the ticket. SWAP is handled in eligible(). """
+        if flags & self.EMPTY:
+            return False
+        if ticket == 'DELETE':
+            return not flags & self.PUNCTUATION
+        if ticket == 'KANJI':
+            return not flags & self.KATAKANA and bool(flags & (self.PARTICLE | self.HOMONYMS))
+        return True
+
+    def eligible(self, ticket, detokens, num_valid_tokens):
+        """
+        Get every index that the ticket can be applied to.
+
+        Params:
+        ------
+        ticket: str:
+            the permutation that was rolled: SWAP, DELETE, INSERT or KANJI
+        detokens: list:
+            the current token-split list of strings, obtained from converting the tokenized sentence back into characters
+        num_valid_tokens: int:
+            the number of non-padding, non-EOS, non-CLS etc. tokens in the string
+
+        Returns:
+        -------
+        positions: list:
+            the eligible indices, between 1 and num_valid_tokens inclusive. For SWAP, (index, neighbour) tuples instead,
+            one for each neighbour of the index that it isn't identical to
+        """
+        if ticket == 'SWAP':
+            # A swap is bogus if it is with an identical neighbour, so only the neighbours that differ are eligible
+            positions = []
+            for i in range(1, 1 + num_valid_tokens):
+                if i > 1 and detokens[i] != detokens[i - 1]:
+                    positions.append((i, i - 1))
+                if i < num_valid_tokens and detokens[i] != detokens[i + 1]:
+                    positions.append((i, i + 1))
+            return positions
+
+        return [i for i in range(1, 1 + num_valid_tokens) if self.is_eligible(ticket, self.classify(detokens[i]))]
+
+    def draw_index(self, ticket, detokens, num_valid_tokens):
+        """
+        Draws a random eligible position for the ticket. Returns (index, neighbour), where neighbour is the index to swap
+        with for SWAP and None otherwise, or (None, None) if there are no eligible positions.
+        """
+        positions = self.eligible(ticket, detokens, num_valid_tokens)
+        if not positions:
+            self.no_eligible += 1
+            if self.logging:
+                print(f'ELIGBL: No eligible position for {ticket}.')
+            return None, None
+        position = positions[self.rng.integers(0, len(positions))]
+        return position if ticket == 'SWAP' else (position, None)
@@ -0,0 +1,148 @@
+import argparse
+import csv
+import json
+import os
+from collections import defaultdict
+from glob import glob
+
+import numpy as np
+
+HOMOPHONE_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'homophone-index.json')
+
+
+class HomophoneIndex:
+    """
+    An index of whole words by reading, so that the KanjiKing can swap a word for a frequency-weighted word with the
+    same reading in one lookup, eg. 機会 -> 機械, 意外 -> 以外. Built offline by build_index() from a MeCab dictionary.
+
+    Params:
+    ------
+    readings: dict:
+        katakana readings as keys, and a list of [word, weight] with that reading as values, only for readings with at
+        least two words
+    surfaces: dict:
+        every word in the index as keys, and its reading as values, or None if the word has more than one reading
+    """
+    def __init__(self, readings, surfaces):
+        """
+        Creates an instance of the HomophoneIndex class.
+
+        Params:
+        ------
+        readings: dict:
+            katakana readings as keys, and a list of [word, weight] with that reading as values, only for readings with
+            at least two words
+        surfaces: dict:
+            every word in the index as keys, and its reading as values, or None if the word has more than one reading
+        """
+        self.surfaces = surfaces
+
+        # The words of each reading, with their cumulative weights ready for drawing
+        self.readings = {}
+        for reading, entries in readings.items():
+            self.readings[reading] = ([word for word, _ in entries], np.cumsum([weight for _, weight in entries]))
+
+    @classmethod
+    def load(cls, path=HOMOPHONE_INDEX_PATH):
+        """ Loads an index written by build_index(). """
+        with open(path, 'r') as r:
+            index = json.load(r)
+        return cls(index['readings'], index['surfaces'])
+
+    def __contains__(self, word):
+        return word in self.surfaces
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def reading_of(self, word):
+        """ Returns the reading of a word, or None if it has more than one reading or isn't in the index. """
+        return self.surfaces.get(word)
+
+    def candidates(self, reading):
+        """ Returns (words, cumulative weights) for a reading, or None if no two words share it. """
+        return self.readings.get(reading)
+
+
+def read_dictionary(paths, surface_column, reading_column, encoding):
+    """ Yields (surface, reading) for every entry of MeCab dictionary CSV files, or of every .csv in a directory. """
+    for path in paths:
+        files = sorted(glob(os.path.join(path, '*.csv'))) if os.path.isdir(path) else [path]
+        for file in files:
+            with open(file, 'r', encoding=encoding, errors='replace', newline='') as r:
+                for row in csv.reader(r):
+                    if len(row) > max(surface_column, reading_column):
+                        yield row[surface_column], row[reading_column]
+
+
+def build_index(entries, frequency_dict, min_length=1):
+    """
+    Groups dictionary words by reading. Only words made entirely of kanji in the frequency list (常用漢字) are kept, and
+    each is weighted by the frequency of its rarest kanji, since a word can't be more common than any of its kanji.
+
+    Params:
+    ------
+    entries: iterable:
+        (surface, reading) of every dictionary entry, eg. from read_dictionary()
+    frequency_dict: dict:
+        a dictionary with kanji as keys, and their frequency in JP Wikipedia as values
+    min_length: int:
+        the minimum number of kanji in a word
+
+    Returns:
+    -------
+    index: dict:
+        the readings and surfaces of a HomophoneIndex, ready to be saved as JSON
+    """
+    words_of_reading = defaultdict(set)
+    readings_of_word = defaultdict(set)
+    for surface, reading in entries:
+        if len(surface) < min_length or not reading or reading == '*':
+            continue
+        if not all([x in frequency_dict for x in surface]):
+            continue
+        words_of_reading[reading].add(surface)
+        readings_of_word[surface].add(reading)
+
+    readings = {}
+    for reading in sorted(words_of_reading):
+        words = words_of_reading[reading]
+        if len(words) > 1:
+            entries = [[word, min([frequency_dict[x] for x in word])] for word in words]
+            readings[reading] = sorted(entries, key=lambda entry: (-entry[1], entry[0]))
+
+    surfaces = {}
+    for reading, entries in readings.items():
+        for word, _ in entries:
+            surfaces[word] = reading if len(readings_of_word[word]) == 1 else None
+
+    return {'readings': readings, 'surfaces': dict(sorted(surfaces.items()))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the word-level homophone index from a MeCab dictionary.')
+    parser.add_argument('dictionary', nargs='+', help='MeCab dictionary CSV files, or directories of them')
+    parser.add_argument('--output', default=HOMOPHONE_INDEX_PATH, help='file that the index is written to')
+    parser.add_argument('--frequency-list', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 'frequency-list.json'),
+                        help='JSON of kanji frequencies that words are filtered and weighted by')
+    parser.add_argument('--surface-column', type=int, default=0, help='CSV column of the surface form')
+    parser.add_argument('--reading-column', type=int, default=10,
+                        help='CSV column of the katakana reading: 10 (lForm) for UniDic, 11 for IPADIC')
+    parser.add_argument('--encoding', default='utf-8', help='encoding of the CSV files, eg. euc-jp for IPADIC')
+    parser.add_argument('--min-length', type=int, default=1, help='minimum number of kanji in a word')
+    args = parser.parse_args()
+
+    with open(args.frequency_list, 'r') as fl:
+        frequency_dict = json.loads(fl.read())
+
+    index = build_index(read_dictionary(args.dictionary, args.surface_column, args.reading_column, args.encoding),
+                        frequency_dict, args.min_length)
+    with open(args.output, 'w') as w:
+        json.dump(index, w)
+
+    num_words = sum([len(entries) for entries in index['readings'].values()])
+    num_ambiguous = sum([reading is None for reading in index['surfaces'].values()])
+    print(f'{len(index["readings"]):,} readings shared by {num_words:,} words '
+          f'({len(index["surfaces"]):,} distinct, {num_ambiguous:,} with more than one reading).')
+    print(f'Homophone index written to {args.output}.')
@@ -82,7 +82,7 @@ class Inserter:
         for i, cumul_frequency in enumerate(self.cumul_kanji_frequencies):
             if kanji_ticket_no < cumul_frequency:
                 if self.logging:
-                    print(f'INSERT: Tombola drew {self.joyo[i]} for ticket no {kanji_ticket_no} of cumul_frequencies {self.cumul_kanji_frequencies}')
+                    print(f'INSERT: Tombola drew {self.joyo[i]} for ticket no {kanji_ticket_no} of {self.cumul_kanji_frequencies[-1]}')
                 return self.joyo[i]
 
     def insert(self, detokens, err_label, index):
@@ -93,6 +93,7 @@ class Inserter:
         ------
         detokens: list:
             the current token-split list of strings, obtained from converting the tokenized sentence back into characters
+            with the pipeline's VocabTable, so already cleaned of #
         err_label: list:
             the current list of 0, 1 and 2 labels assigned to each token
         index: int:
@@ -107,7 +108,7 @@ class Inserter:
         """
         ticket = self.insert_lotto()
 
-        isolated_detoken = detokens[index].replace('#', '')
+        isolated_detoken = detokens[index]
         # Check that the token does not consist only of #
         if len(isolated_detoken) == 0:
             if self.logging:
@@ -0,0 +1,305 @@
+"""
+Multi-node generation without a coordinator. The input file is split into newline-aligned byte ranges, which are written
+to a JSON manifest next to a shard directory on shared storage. Any number of workers, on any number of machines, then
+claim ranges and generate them independently. Claims and completion are plain files in the shard directory:
+
+range-00000.claim: created with O_CREAT | O_EXCL, so exactly one worker can claim a range. Its modification time is
+                   refreshed while the range is processed, and a claim that hasn't been refreshed for stale_after seconds
+                   can be taken over (by atomically renaming it away first, so only one worker wins the takeover).
+range-00000.txt:   the output pairs, written to a .part file named after the worker and renamed into place when the
+                   range is finished, but only if the claim still names that worker. A worker whose claim was taken
+                   over stops at its next heartbeat and discards its output.
+range-00000.json:  the metrics for the range, renamed into place last. Its existence marks the range as done.
+
+Each range is generated with a random number generator seeded by (manifest seed, range id), so re-running a range
+always produces the same output. merge() checks that every range is done and intact, then concatenates the outputs in
+order and sums the metrics.
+"""
+import json
+import os
+import shutil
+import socket
+from time import time
+
+import numpy as np
+
+from pipeline import Pipeline, write_pair
+
+
+def range_path(shard_dir, range_id, extension):
+    return os.path.join(shard_dir, f'range-{range_id:05d}.{extension}')
+
+
+def plan(input_path, manifest_path, shard_dir, num_ranges, seed=None):
+    """
+    Split the input into newline-aligned byte ranges and write the job manifest.
+
+    Params:
+    ------
+    input_path: str:
+        file of correct lines, one per line
+    manifest_path: str:
+        file that the JSON manifest is written to
+    shard_dir: str:
+        directory that workers write claims, outputs and metrics to
+    num_ranges: int:
+        the number of ranges to aim for (fewer are made if the file has fewer lines)
+    seed: int or None:
+        the base seed for every range, a random one is drawn and saved if None
+
+    Returns:
+    -------
+    manifest: dict:
+        the manifest that was written
+    """
+    size = os.path.getsize(input_path)
+    boundaries = [0]
+    with open(input_path, 'rb') as r:
+        for i in range(1, num_ranges):
+            # Move each boundary forward to the start of the next line
+            r.seek(max(boundaries[-1], size * i // num_ranges))
+            if r.tell() > 0:
+                r.seek(r.tell() - 1)
+                r.readline()
+            if r.tell() >= size:
+                break
+            if r.tell() > boundaries[-1]:
+                boundaries.append(r.tell())
+    boundaries.append(size)
+
+    manifest = {
+        'input': os.path.abspath(input_path),
+        'input_size': size,
+        'shard_dir': os.path.abspath(shard_dir),
+        'seed': int(np.random.SeedSequence().entropy % 2 ** 63) if seed is None else seed,
+        'ranges': [{'id': i, 'start': start, 'end': end}
+                   for i, (start, end) in enumerate(zip(boundaries[:-1], boundaries[1:]))],
+    }
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(manifest_path, 'w') as w:
+        json.dump(manifest, w, indent=1)
+    return manifest
+
+
+def part_path(path, worker):
+    """ The file that a worker writes before renaming it into place, so that two workers never write the same file. """
+    return f'{path}.{worker.replace(":", "-").replace(os.sep, "-")}.part'
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, 'r') as r:
+        return json.load(r)
+
+
+def is_done(shard_dir, range_id):
+    return os.path.exists(range_path(shard_dir, range_id, 'json'))
+
+
+def claim(shard_dir, range_id, worker, stale_after):
+    """ Try to claim a range. Returns True if this worker now owns it. """
+    if is_done(shard_dir, range_id):
+        return False
+
+    claim_path = range_path(shard_dir, range_id, 'claim')
+    try:
+        fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # Take over the claim if its worker has stopped refreshing it
+        try:
+            if time() - os.path.getmtime(claim_path) < stale_after:
+                return False
+            os.rename(claim_path, f'{claim_path}.stale-{worker.replace(":", "-").replace(os.sep, "-")}')
+        except FileNotFoundError:
+            return False  # Another worker finished or took over the range first
+        return claim(shard_dir, range_id, worker, stale_after)
+
+    with os.fdopen(fd, 'w') as w:
+        w.write(worker)
+    # The range may have been finished between the done check and the claim
+    if is_done(shard_dir, range_id):
+        os.remove(claim_path)
+        return False
+    return True
+
+
+def owns_claim(shard_dir, range_id, worker):
+    """ Whether the claim of a range still exists and names this worker, ie. it hasn't been taken over. """
+    try:
+        with open(range_path(shard_dir, range_id, 'claim'), 'r') as r:
+            return r.read() == worker
+    except FileNotFoundError:
+        return False
+
+
+def heartbeat(shard_dir, range_id, worker):
+    """
+    Refresh the modification time of a claim, so that it isn't taken over as stale. Returns False if the claim was
+    already taken over by another worker.
+    """
+    if not owns_claim(shard_dir, range_id, worker):
+        return False
+    try:
+        os.utime(range_path(shard_dir, range_id, 'claim'))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def generate_range(pipeline, prefilter, input_path, start, end, output_path, on_progress=None):
+    """
+    Generate pairs for every line in a byte range of the input file. Lines are traced by their byte offset in the
+    input, if the pipeline has a trace.
+
+    Params:
+    ------
+    pipeline: Pipeline:
+        the pipeline, already seeded for this range
+    prefilter: PreFilter or None:
+        if given, the lines that it rejects are skipped. Its counts are reset first
+    input_path: str:
+        file of correct lines, one per line
+    start: int:
+        the byte offset of the first line in the range
+    end: int:
+        the byte offset just after the last line in the range
+    output_path: str:
+        file that the output pairs are written to
+    on_progress: callable or None:
+        called every 10,000 lines, eg. to refresh the claim. If it returns False, the range is abandoned
+
+    Returns:
+    -------
+    metrics: dict or None:
+        counts of lines read, invalid lines, line statuses and pre-filter rejections, plus output size and time taken.
+        None if the range was abandoned
+    """
+    begin = time()
+    metrics = {'lines_read': 0, 'invalid': 0}
+    metrics.update({status: 0 for status in (Pipeline.WRITTEN, Pipeline.NO_PERM, Pipeline.BAILED, Pipeline.BOGUS)})
+    if prefilter is not None:
+        prefilter.reset()
+
+    with open(input_path, 'rb') as r, open(output_path, 'w') as a:
+        r.seek(start)
+        while r.tell() < end:
+            offset = r.tell()
+            raw_line = r.readline()
+            metrics['lines_read'] += 1
+            if on_progress is not None and metrics['lines_read'] % 10_000 == 0 and on_progress() is False:
+                return None
+
+            try:
+                line = raw_line.decode('utf-8')
+            except UnicodeDecodeError:
+                metrics['invalid'] += 1
+                continue
+
+            status, pair = pipeline.generate(line, offset, prefilter)
+            if status is None:
+                continue
+            metrics[status] += 1
+            if status == Pipeline.WRITTEN:
+                write_pair(a, pair)
+
+    if prefilter is not None:
+        metrics['prefilter_passed'] = prefilter.passed
+        metrics.update({f'prefilter_{rule}': count for rule, count in prefilter.counts.items()})
+    metrics['output_bytes'] = os.path.getsize(output_path)
+    metrics['seconds'] = time() - begin
+    return metrics
+
+
+def work(manifest_path, pipeline, prefilter=None, stale_after=3600, worker=None):
+    """
+    Claim and generate ranges from the manifest until none are left. Safe to run on any number of machines at once.
+    Returns the ids of the ranges this worker generated.
+    """
+    manifest = load_manifest(manifest_path)
+    shard_dir = manifest['shard_dir']
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    done = []
+
+    # Start at a different range on each worker, so that they don't all race for the same claims
+    ranges = manifest['ranges']
+    offset = int(np.random.default_rng().integers(0, len(ranges)))
+    for job in ranges[offset:] + ranges[:offset]:
+        range_id = job['id']
+        if not claim(shard_dir, range_id, worker, stale_after):
+            continue
+
+        print(f'{worker} claimed range {range_id} ({job["end"] - job["start"]:,} bytes).')
+        pipeline.set_rng(np.random.default_rng([manifest['seed'], range_id]))
+        output_path = range_path(shard_dir, range_id, 'txt')
+        metrics_path = range_path(shard_dir, range_id, 'json')
+        metrics = generate_range(pipeline, prefilter, manifest['input'], job['start'], job['end'],
+                                 part_path(output_path, worker),
+                                 on_progress=lambda: heartbeat(shard_dir, range_id, worker))
+
+        # Only publish if the claim wasn't taken over while generating, otherwise the new owner publishes the range
+        if metrics is None or not owns_claim(shard_dir, range_id, worker) or is_done(shard_dir, range_id):
+            os.remove(part_path(output_path, worker))
+            print(f'{worker} lost its claim on range {range_id} and discarded its output.')
+            continue
+
+        # Output first, then the metrics, whose existence marks the range as done
+        metrics['worker'] = worker
+        with open(part_path(metrics_path, worker), 'w') as w:
+            json.dump(metrics, w)
+        os.replace(part_path(output_path, worker), output_path)
+        os.replace(part_path(metrics_path, worker), metrics_path)
+        try:
+            os.remove(range_path(shard_dir, range_id, 'claim'))
+        except FileNotFoundError:
+            pass
+        done.append(range_id)
+        print(f'{worker} finished range {range_id} in {metrics["seconds"]:.1f} seconds.')
+    return done
+
+
+def verify(manifest):
+    """ Returns a list of problems with the shard directory, which is empty if every range is done and intact. """
+    shard_dir = manifest['shard_dir']
+    problems = []
+    for job in manifest['ranges']:
+        range_id = job['id']
+        if not is_done(shard_dir, range_id):
+            claim_path = range_path(shard_dir, range_id, 'claim')
+            problems.append(f'range {range_id} is ' + ('claimed but not done' if os.path.exists(claim_path)
+                                                      else 'unclaimed'))
+            continue
+        with open(range_path(shard_dir, range_id, 'json'), 'r') as r:
+            metrics = json.load(r)
+        output_path = range_path(shard_dir, range_id, 'txt')
+        if not os.path.exists(output_path) or os.path.getsize(output_path) != metrics['output_bytes']:
+            problems.append(f'range {range_id} output is missing or does not match its metrics')
+    return problems
+
+
+def merge(manifest_path, output_path):
+    """
+    Verify that every range is done, then concatenate the outputs in order into output_path and sum the metrics, which
+    are also written to output_path + '.json'. Returns the summed metrics, or None if verification failed.
+    """
+    manifest = load_manifest(manifest_path)
+    problems = verify(manifest)
+    if problems:
+        print(f'Cannot merge, {len(problems)} of {len(manifest["ranges"])} ranges have problems:')
+        for problem in problems:
+            print(f'  {problem}')
+        return None
+
+    shard_dir = manifest['shard_dir']
+    totals = {}
+    with open(output_path, 'wb') as w:
+        for job in manifest['ranges']:
+            with open(range_path(shard_dir, job['id'], 'txt'), 'rb') as r:
+                shutil.copyfileobj(r, w)
+            with open(range_path(shard_dir, job['id'], 'json'), 'r') as r:
+                for key, value in json.load(r).items():
+                    if isinstance(value, (int, float)):
+                        totals[key] = totals.get(key, 0) + value
+    totals['ranges'] = len(manifest['ranges'])
+
+    with open(output_path + '.json', 'w') as w:
+        json.dump(totals, w, indent=1)
+    return totals
@@ -1,8 +1,13 @@
+import numpy as np
+
+
 class KanjiKing:
     """
     The Kanji King has two important jobs:
     1. Swapping a Kanji for a frequency-weighted alternative Kanji of the same reading eg. 高 -> 後
     2. Swapping a particle for another random particle eg. は -> が
+    If a homophone index is given, a token that is a whole word in the index is first swapped for a frequency-weighted
+    word with the same reading eg. 機会 -> 機械, falling back to the single kanji swap when the word has no homophones.
     The type of transformation depends on the contents of the randomly selected token. If the token contains a single
     kanji only, eg. 高, then this kanji will be swapped. If the token contains multiple kanji eg. 高速, one of the
     kanji will be randomly selected, then swapped. If the token contains only a particle eg. は, then that particle
@@ -18,10 +23,12 @@ class KanjiKing:
         a dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字)
     frequency_dict: dict:
         a dictionary with kanji as keys, and their frequency in JP Wikipedia as values
+    homophones: HomophoneIndex or None:
+        the word-level homophone index built by homophones.py, or None to only swap single kanji
     logging: bool:
         set to True to print logs for every step of the process
     """
-    def __init__(self, rng, tagger, kanji_dictionary, frequency_dict, logging=True):
+    def __init__(self, rng, tagger, kanji_dictionary, frequency_dict, homophones=None, logging=True):
         """
         Create an instance of the KanjiKing class.
 
@@ -35,11 +42,14 @@ class KanjiKing:
             a dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字 only)
         frequency_dict: dict:
             a dictionary with kanji as keys, and their frequency in JP Wikipedia as values
+        homophones: HomophoneIndex or None:
+            the word-level homophone index built by homophones.py, or None to only swap single kanji
         logging: bool:
             set to True to print logs for every step of the process
         """
         self.kanji_dictionary = kanji_dictionary
         self.frequency_dict = frequency_dict
+        self.homophones = homophones
 
         self.rng = rng
         self.tagger = tagger
@@ -89,6 +99,27 @@ class KanjiKing:
         # Otherwise return the new kanji
         return new_kanji
 
+    def get_new_word_token(self, word, reading):
+        """ Draws a frequency-weighted word with the same reading, other than the word. Returns False if there are none. """
+        candidates = self.homophones.candidates(reading)
+        if candidates is None or (len(candidates[0]) == 1 and candidates[0][0] == word):
+            if self.logging:
+                print(f'KANJI : No homophones of {word} were found for reading {reading}.')
+            return False
+
+        # Leave the word's own range out of the tombola, so the same word is never drawn
+        words, tombola = candidates
+        start, weight = 0, 0
+        if word in words:
+            own = words.index(word)
+            start = tombola[own - 1] if own > 0 else 0
+            weight = tombola[own] - start
+
+        word_ticket_no = self.rng.integers(0, tombola[-1] - weight)
+        if word_ticket_no >= start:
+            word_ticket_no += weight
+        return words[np.searchsorted(tombola, word_ticket_no, side='right')]
+
     def particle_lotto(self):
         """ Choose an unweighted random particle from the particle list. """
         return self.particles_short[self.rng.integers(0, len(self.particles_short))]
@@ -101,6 +132,7 @@ class KanjiKing:
         ------
         detokens: list:
             the current token-split list of strings, obtained from converting the tokenized sentence back into characters
+            with the pipeline's VocabTable, so already cleaned of #
         err_label: list:
             the current list of 0, 1 and 2 labels assigned to each token
         index: int:
@@ -113,7 +145,7 @@ class KanjiKing:
         err_label: list:
             the updated list of 0, 1 and 2 labels assigned to each token
         """
-        isolated_detoken = detokens[index].replace('#', '')
+        isolated_detoken = detokens[index]
 
         if len(isolated_detoken) == 0:
             print(f'Detoken {isolated_detoken} at {index} had length 0 and so returning. Full detokens: {detokens}')
@@ -139,9 +171,30 @@ class KanjiKing:
                 print(f'KANJI : Particle swapsie of {isolated_detoken} for {new_particle} at {index}. (PARTICLE EXCHANGE)')
             return detokens, err_label
 
-        # Parse the token with MeCab
+        # Swap the whole word for a word with the same reading, in one lookup of the homophone index
+        tag = None
+        if self.homophones is not None and isolated_detoken in self.homophones:
+            reading = self.homophones.reading_of(isolated_detoken)
+            if reading is None:
+                # The word has more than one reading, so let MeCab pick one
+                try:
+                    tag = self.tagger.parse(isolated_detoken).split('\n')[1].split(',')
+                    reading = tag[6]
+                except IndexError:
+                    pass
+
+            new_word = self.get_new_word_token(isolated_detoken, reading) if reading else False
+            if new_word:
+                if self.logging:
+                    print(f'KANJI : Replaced {isolated_detoken} at index {index} with {new_word}. (WORD EXCHANGE).')
+                detokens[index] = new_word
+                err_label[index] = 2
+                return detokens, err_label
+
+        # Parse the token with MeCab, unless it was already parsed for the homophone index
         try:
-            tag = self.tagger.parse(isolated_detoken).split('\n')[1].split(',')
+            if tag is None:
+                tag = self.tagger.parse(isolated_detoken).split('\n')[1].split(',')
             # Get the type and reading
             tok_type = tag[12]
             tok_reading = tag[6]
@@ -0,0 +1,191 @@
+import json
+import random
+import struct
+from collections import deque
+
+import numpy as np
+
+# Record types
+LINE = 0
+OP = 1
+END = 2
+
+OP_CODES = {'SWAP': 0, 'DELETE': 1, 'INSERT': 2, 'KANJI': 3}
+OP_NAMES = {code: name for name, code in OP_CODES.items()}
+STATUS_CODES = {'WRITTEN': 0, 'NO_PERM': 1, 'BAILED': 2, 'BOGUS': 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+# Every record starts with the record type and the line id
+HEADER = struct.Struct('<BQ')
+OP_FIELDS = struct.Struct('<BBh')
+
+
+class OpTrace:
+    """
+    A low overhead, structured trace of the permutations applied to a sample of lines, for debugging without printing.
+    For each sampled line, three kinds of compact record are kept:
+    LINE: the line id, the line itself and the state of the random number generator just before it was permuted
+    OP: the permutation, the index it was applied to, the detoken at that index before and after, and the change in
+        the number of error labels
+    END: the status of the line (WRITTEN, NO_PERM, BAILED or BOGUS)
+    Records go into an in-memory ring buffer of the most recent buffer_size records, and, if a path is given, are
+    written to a binary sidecar file, which is overwritten by each run. Because the random number generator state is
+    saved, any traced line can be replayed exactly with replay().
+
+    Sampling uses its own random number generator, so turning the trace on doesn't change the generated data.
+
+    Params:
+    ------
+    path: str or None:
+        binary sidecar file that records are written to, or None to only keep the ring buffer
+    sample_rate: float:
+        the fraction of lines that are traced
+    buffer_size: int:
+        the number of most recent records kept in memory
+    seed: int or None:
+        seed for the sampling random number generator
+    """
+    def __init__(self, path=None, sample_rate=0.001, buffer_size=10_000, seed=None):
+        """
+        Creates an instance of the OpTrace class.
+
+        Params:
+        ------
+        path: str or None:
+            binary sidecar file that records are written to, or None to only keep the ring buffer
+        sample_rate: float:
+            the fraction of lines that are traced
+        buffer_size: int:
+            the number of most recent records kept in memory
+        seed: int or None:
+            seed for the sampling random number generator
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.buffer = deque(maxlen=buffer_size)
+        self.sampler = random.Random(seed)
+        # Line ids restart on every run, so each run starts a fresh file rather than appending to an old one
+        self.file = open(path, 'wb') if path else None
+
+        self.active = False
+        self.line_id = 0
+        self.num_traced = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _write(self, record_type, payload):
+        if self.file is not None:
+            self.file.write(HEADER.pack(record_type, self.line_id) + payload)
+
+    @staticmethod
+    def _pack_string(string, length_format='<H'):
+        data = string.encode('utf-8')
+        return struct.pack(length_format, len(data)) + data
+
+    def start_line(self, line_id, line, rng):
+        """ Decide whether to trace the line, and if so record it and the rng state. Returns True if it is traced. """
+        self.active = self.sampler.random() < self.sample_rate
+        if not self.active:
+            return False
+
+        self.line_id = line_id
+        self.num_traced += 1
+        state = rng.bit_generator.state
+        self.buffer.append((LINE, line_id, line, state))
+        if self.file is not None:
+            self._write(LINE, self._pack_string(json.dumps(state), '<I') + self._pack_string(line, '<I'))
+        return True
+
+    def record(self, ticket, index, before, after, label_delta):
+        """ Record a single permutation of the current line, if it is being traced. """
+        if not self.active:
+            return
+        self.buffer.append((OP, self.line_id, ticket, index, before, after, label_delta))
+        if self.file is not None:
+            self._write(OP, OP_FIELDS.pack(OP_CODES[ticket], index, label_delta)
+                        + self._pack_string(before) + self._pack_string(after))
+
+    def end_line(self, status):
+        """ Record the status of the current line, if it is being traced. """
+        if not self.active:
+            return
+        self.buffer.append((END, self.line_id, status))
+        self._write(END, struct.pack('<B', STATUS_CODES[status]))
+        self.active = False
+
+
+def read_trace(path):
+    """ Yields every record in a sidecar file as a tuple, in the same format as OpTrace.buffer. """
+    with open(path, 'rb') as r:
+        data = r.read()
+
+    def read_string(offset, length_format='<H'):
+        size = struct.calcsize(length_format)
+        (length,) = struct.unpack_from(length_format, data, offset)
+        return data[offset + size:offset + size + length].decode('utf-8'), offset + size + length
+
+    offset = 0
+    while offset < len(data):
+        record_type, line_id = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        if record_type == LINE:
+            state, offset = read_string(offset, '<I')
+            line, offset = read_string(offset, '<I')
+            yield LINE, line_id, line, json.loads(state)
+        elif record_type == OP:
+            op_code, index, label_delta = OP_FIELDS.unpack_from(data, offset)
+            before, offset = read_string(offset + OP_FIELDS.size)
+            after, offset = read_string(offset)
+            yield OP, line_id, OP_NAMES[op_code], index, before, after, label_delta
+        else:
+            (status_code,) = struct.unpack_from('<B', data, offset)
+            offset += 1
+            yield END, line_id, STATUS_NAMES[status_code]
+
+
+def replay(records, line_id, pipeline):
+    """
+    Re-run a traced line through the pipeline with the recorded rng state, and check that it applies exactly the same
+    permutations again.
+
+    Params:
+    ------
+    records: iterable:
+        trace records, from read_trace() or OpTrace.buffer
+    line_id: int:
+        the id of the line to replay
+    pipeline: Pipeline:
+        the pipeline to replay the line with, set up with the same hyperparameters as the original run
+
+    Returns:
+    -------
+    recorded: list:
+        the records of the line from the trace
+    replayed: list:
+        the records of the line from the replay
+    result: tuple:
+        the (status, pair) returned by the pipeline for the replayed line
+    """
+    recorded = [record for record in records if record[1] == line_id]
+    if not recorded or recorded[0][0] != LINE:
+        raise KeyError(f'Line {line_id} was not traced.')
+    _, _, line, state = recorded[0]
+
+    rng = np.random.default_rng()
+    rng.bit_generator.state = state
+    trace = OpTrace(sample_rate=1.)
+    previous_rng, previous_trace = pipeline.rng, pipeline.trace
+    pipeline.set_rng(rng)
+    pipeline.trace = trace
+    try:
+        trace.start_line(line_id, line, rng)
+        result = pipeline.permutate(line)
+        trace.end_line(result[0])
+    finally:
+        pipeline.set_rng(previous_rng)
+        pipeline.trace = previous_trace
+
+    return recorded, list(trace.buffer), result
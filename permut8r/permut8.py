@@ -1,88 +1,135 @@
-import json
+import argparse
+from contextlib import nullcontext
 from time import time
 
-import MeCab
 import numpy as np
-from transformers import BertJapaneseTokenizer
 
-from deleter import Deleter
-from inserter import Inserter
-from kanjiking import KanjiKing
-from reconstructor import Reconstructor
-from swapper import Swapper
-
-
-def encode(sentence):
-    """ Converts a sentence into it's tokenized output. Returns a dictionary with input_ids and attention_mask. """
-    return tokenizer.encode_plus(
-        sentence,
-        add_special_tokens=True,
-        max_length=max_tok_length,
-        padding='max_length',
-        return_attention_mask=True,
-        truncation=True
-    )
-
-
-def lotto():
-    """ Eyyy step right up, step right up, get your lucky tickets here. Contains weightings for permutations. """
-    ticket_no = rng.uniform()
-
-    if ticket_no <= 0.15:
-        return 'SWAP'
-    elif ticket_no <= 0.45:
-        return 'DELETE'
-    elif ticket_no <= 0.75:
-        return 'INSERT'
-    else:
-        return 'KANJI'
-
-
-def count_non_bert_tokens(total, tokens):
-    # Counts the number of valid tokens which aren't CLS, PAD or SEP
-    return total - (sum([x in [0, 2, 3] for x in tokens]))
+import jobs
+from optrace import OpTrace, read_trace, replay
+from pipeline import Pipeline, write_pair
+from prefilter import PreFilter
+from profiler import Profiler
+from shards import ShardWriter
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Generate permuted sentence / label pairs from a file of correct lines.')
+    parser.add_argument('--input', default='./testing.txt', help='file of correct lines, one per line')
+    parser.add_argument('--output', default='permutations.txt', help='file that the output pairs are written to')
+    parser.add_argument('--buckets', help='comma separated token length bounds, eg. 16,24,32,48, to write one shard '
+                                          'per length bucket with an index instead of a single --output file')
+    parser.add_argument('--seed', type=int, help='seed for the random number generator, random if not given')
+    parser.add_argument('--plan', type=int, metavar='N',
+                        help='split --input into N newline-aligned byte ranges and write the job manifest, then exit')
+    parser.add_argument('--work', action='store_true', help='claim and generate ranges from the job manifest')
+    parser.add_argument('--merge', action='store_true',
+                        help='verify that every range in the job manifest is done, and merge them into --output')
+    parser.add_argument('--manifest', default='manifest.json', help='the job manifest used by --plan, --work and --merge')
+    parser.add_argument('--shard-dir', default='shards', help='directory for range claims and outputs, used by --plan')
+    parser.add_argument('--stale-after', type=float, default=3600,
+                        help='seconds after which an unrefreshed claim is taken over by --work')
+    parser.add_argument('--blocklist', help='file of regex patterns, one per line, to reject lines with before tokenizing')
+    parser.add_argument('--no-prefilter', action='store_true', help='tokenize and permute every line, however useless')
+    parser.add_argument('--trace', metavar='PATH', help='write a binary trace of the permutations of sampled lines to PATH')
+    parser.add_argument('--trace-rate', type=float, default=0.001, help='the fraction of lines that are traced')
+    parser.add_argument('--replay', metavar='PATH', help='replay a line from a trace file with logging on, then exit')
+    parser.add_argument('--line-id', type=int, help='the id of the line to replay')
+    parser.add_argument('--profile', type=int, metavar='N', default=0,
+                        help='profile the first N lines only, and write a report grouped by subsystem')
+    parser.add_argument('--profile-mode', choices=['cprofile', 'sample'], default='cprofile',
+                        help='deterministic cProfile, or the lower overhead sampling profiler')
+    parser.add_argument('--profile-report', default='profile-report.txt', help='file that the profile report is written to')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='skip allocation tracing while profiling')
+    args = parser.parse_args()
+
+    # Ranges are merged into a single file, and workers run until no ranges are left, so there is nothing to profile
+    if args.work and args.buckets:
+        parser.error('--buckets can\'t be used with --work, ranges are merged into a single --output file.')
+    if args.work and args.profile:
+        parser.error('--profile can\'t be used with --work, profile a single file run instead.')
+    return args
 
 
 if __name__ == '__main__':
+    args = get_args()
+
     # ============ HYPERPARAMETERS ============
     # The probability that a token will be left unaltered
     no_perm_probability = 6. / 7
     # The token length of the output sequences
     max_tok_length = 48
+    # Pre-filter bounds: lines outside these are rejected before tokenization
+    min_line_chars = 5
+    max_line_chars = 120  # Roughly 2.5 characters per token, longer lines would be heavily truncated
+    min_japanese_ratio = 0.5  # The minimum fraction of kana and kanji characters in a line
     # =========================================
 
-    with open('kanji-dictionary.json', 'r') as kj:
-        # A dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字)
-        kanji_dictionary = json.loads(kj.read())
-    with open('frequency-list.json', 'r') as fl:
-        frequency_dict = json.loads(fl.read())
-
-    # Set up tagger, tokenizer, rng
-    tagger = MeCab.Tagger('-r /dev/null -d /home/y4tsu/anaconda3/lib/python3.8/site-packages/unidic_lite/dicdir -Odump')
-    tokenizer = BertJapaneseTokenizer.from_pretrained('cl-tohoku/bert-base-japanese-whole-word-masking')
-    rng = np.random.default_rng()
+    # Planning and merging don't need any of the generation machinery
+    if args.plan:
+        manifest = jobs.plan(args.input, args.manifest, args.shard_dir, args.plan, args.seed)
+        print(f'Planned {len(manifest["ranges"])} ranges with seed {manifest["seed"]}, manifest written to {args.manifest}.')
+        exit()
+    if args.merge:
+        totals = jobs.merge(args.manifest, args.output)
+        if totals is None:
+            exit(1)
+        for key, value in totals.items():
+            print(f'{key + ":":<24}{value:>14,}' if isinstance(value, int) else f'{key + ":":<24}{value:>14,.1f}')
+        print(f'Merged output written to {args.output}, metrics to {args.output}.json.')
+        exit()
+
+    # Set up rng, then create the pipeline, which holds the tagger, tokenizer and all the permutator objects
+    rng = np.random.default_rng(args.seed)
     start = time()
-
-    # Create permutator objects
     logging = False
-    reconstructor = Reconstructor(tokenizer, max_tok_length, logging=False)
-    swapper = Swapper(rng, logging=logging)
-    kk = KanjiKing(rng, tagger, kanji_dictionary, frequency_dict, logging=logging)
-    inserter = Inserter(rng, kanji_dictionary, frequency_dict, logging=logging)
-    deleter = Deleter(rng, logging=logging)
+    pipeline = Pipeline.from_defaults(rng, max_tok_length, no_perm_probability, logging=logging or bool(args.replay))
+
+    if args.replay:
+        recorded, replayed, (status, _) = replay(read_trace(args.replay), args.line_id, pipeline)
+        print(f'Replayed line {args.line_id} with status {status}.')
+        print('Trace matches the replay exactly.' if recorded == replayed else
+              f'Trace does NOT match the replay!\nTrace : {recorded}\nReplay: {replayed}')
+        exit()
+
+    trace = None
+    if args.trace:
+        trace = OpTrace(args.trace, args.trace_rate, seed=args.seed)
+        pipeline.trace = trace
+
+    blocklist = PreFilter.load_blocklist(args.blocklist) if args.blocklist else None
+    prefilter = PreFilter(min_line_chars, max_line_chars, min_japanese_ratio, blocklist, logging=logging)
+
+    if args.work:
+        done = jobs.work(args.manifest, pipeline, None if args.no_prefilter else prefilter, args.stale_after)
+        print(f'No ranges left to claim. Generated {len(done)} ranges in {time() - start:.1f} seconds.')
+        if trace is not None:
+            trace.close()
+            print(f'Traced {trace.num_traced:,} lines to {args.trace}, with their byte offsets as line ids.')
+        exit()
 
     # Progress information - could do with some improvements
     checkpoint = 1_570_000  # 1% of the number of lines in the file
     count_read = 0
+    status_counts = {status: 0 for status in (Pipeline.WRITTEN, Pipeline.NO_PERM, Pipeline.BAILED, Pipeline.BOGUS)}
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(mode=args.profile_mode, memory=not args.no_tracemalloc)
+        print(f'Profiling the first {args.profile:,} lines with {args.profile_mode}.')
+        profiler.start()
 
     print('YO yo YO let\'s gooooooooo')
 
-    with open('./testing.txt', 'r') as r:
-        with open('permutations.txt', 'w') as w:
-            w.write('')
-        with open('permutations.txt', 'a') as a:
+    # Either route pairs into one shard per length bucket, or write them all to a single file
+    shard_writer = None
+    if args.buckets:
+        shard_writer = ShardWriter(args.output.rsplit('.txt', 1)[0], [int(b) for b in args.buckets.split(',')],
+                                   max_tok_length)
+
+    with open(args.input, 'r') as r:
+        # The single output file is only created when the pairs aren't going into length bucket shards
+        with open(args.output, 'w') if shard_writer is None else nullcontext() as a:
             while True:
-                bail = False
                 count_read += 1
 
                 try:
@@ -98,100 +145,41 @@ if __name__ == '__main__':
                           f'{100 * norm_time - (count_read // checkpoint) * norm_time:.1f} seconds remaining.',
                           end="", flush=True)
 
-                if not line:
+                if not line or (args.profile and count_read > args.profile):
                     print(f'End of file reached! Read {count_read} lines. Took {time() - start:.1f} seconds.')
                     print(f'{"Lines read:":<18}{count_read:>12,}')
+                    for status, count in status_counts.items():
+                        print(f'{"Lines " + status.lower() + ":":<18}{count:>12,}')
+                    print(f'{"Lost rolls:":<18}{pipeline.eligibility.no_eligible:>12,}')
+                    if not args.no_prefilter:
+                        print(prefilter.report())
                     break
 
-                # PRE-CLEAN
-                line = line.strip().strip('\n')
-
-                # TOKENIZE, DE-TOKENIZE, MAKE LABELS
-                tokens = encode(line)['input_ids']
-                detokens = tokenizer.convert_ids_to_tokens(tokens)
-                original_detokens = detokens.copy()
-                num_valid_tokens = count_non_bert_tokens(max_tok_length, tokens)
-                corr_label = [0] + [1] * num_valid_tokens + (max_tok_length - 1 - num_valid_tokens) * [0]
-                err_label = corr_label.copy()
-
-                # ROLL
-                num_to_permutate = sum(np.where(rng.uniform(size=num_valid_tokens) > no_perm_probability, 1, 0))
-
-                if logging:
-                    print(f'New line with {num_valid_tokens} valid tokens selected.')
-                    print(f'Rolled {num_to_permutate} permutations.')
-
-                if num_to_permutate == 0:
-                    if logging:
-                        print('No permutation was drawn. :(')
-                        print('-----')
+                # PRE-CLEAN, PRE-FILTER AND PERMUTATE
+                status, pair = pipeline.generate(line, count_read, None if args.no_prefilter else prefilter)
+                if status is None:
                     continue
+                status_counts[status] += 1
 
-                if logging:
-                    print(f'ORIGNL: {detokens}')
+                if status == Pipeline.WRITTEN:
+                    if shard_writer is not None:
+                        shard_writer.write(*pair)
+                    else:
+                        write_pair(a, pair)
 
-                # PERMUTATE
-                for _ in range(num_to_permutate):
-                    # Pick the index that will be permuted
-                    curr_index_to_permutate = rng.integers(1, 1 + num_valid_tokens)
+                if logging and status in (Pipeline.WRITTEN, Pipeline.BOGUS):
+                    print('-----')
 
-                    # Get your lucky ticket
-                    ticket = lotto()
-                    if logging:
-                        print(f'Ticket: Lucky ticket {ticket} rolled for {detokens[curr_index_to_permutate]} at index {curr_index_to_permutate}')
-
-                    # Spend your ticket and update the detoks and err_label with the result
-                    if ticket == 'SWAP':
-                        detokens, err_label = swapper.swap(detokens, original_detokens, err_label, curr_index_to_permutate, num_valid_tokens)
-                    elif ticket == 'KANJI':
-                        detokens, err_label = kk.kanji(detokens, err_label, curr_index_to_permutate)
-                    elif ticket == 'INSERT':
-                        detokens, err_label = inserter.insert(detokens, err_label, curr_index_to_permutate)
-                    else:
-                        detokens, err_label = deleter.delete(detokens, err_label, curr_index_to_permutate, num_valid_tokens)
-
-                    # If the detokens have all been deleted then exit here to prevent errors (unlikely but possible)
-                    if (detokens == ['CLS'] + [''] + ['SEP'] + (['PAD'] * (max_tok_length - 3))) \
-                            or (detokens == ['CLS'] + (['SEP'] * 2) + (['PAD'] * (max_tok_length - 3))):
-                        bail = True
-                        if logging:
-                            print(f'Detokens {detokens} was empty and so line {line} was bailed.')
-                        break
-
-                    # Reconstruct the line, then split again into de-tokens and update the label accordingly
-                    result = reconstructor.reconstruct_line(detokens, err_label, num_valid_tokens)
-                    if not result:
-                        bail = True
-                        if logging:
-                            print(f'Bailing at error ... ')
-                        break
-                    else:
-                        detokens, err_label, num_valid_tokens = result
-                        if logging:
-                            print(f'DETOKS: {detokens}')
-                            print(f'ERR_LB: {err_label}')
+    if shard_writer is not None:
+        print('Pairs per length bucket:')
+        print(shard_writer.report())
+        print(f'Bucket summary written to {shard_writer.close()}.')
 
-                if bail:
-                    continue
+    if trace is not None:
+        trace.close()
+        print(f'Traced {trace.num_traced:,} lines to {args.trace}.')
 
-                # If the final detokens are the same as the original, it's a Bogus Transform™
-                if detokens == original_detokens:
-                    if logging:
-                        print(f'BOGUS TRANSFORM! Original and permuted detokens are the same.')
-                else:
-                    # Otherwise all is good so write 2 lines to the output file
-                    corr_label = "".join([str(x) for x in corr_label])
-                    new_line = reconstructor.toks_to_line(detokens[1:1 + num_valid_tokens])
-                    new_label = "".join([str(x) for x in err_label])
-                    line = line.replace(',', '、')  # Replace commas with JP commas to prevent CSV read errors
-                    new_line = new_line.replace(',', '、')
-                    if logging:
-                        print(f'OUTPUT: Original line: {line}')
-                        print(f'OUTPUT: New line     : {new_line}')
-                        print(f'OUTPUT: Correct label: {corr_label}')
-                        print(f'OUTPUT: Error label  : {new_label}')
-                    a.write(f'{line},{corr_label}\n')  # Save the original line with a label of all 0s and 1s
-                    a.write(f'{new_line},{new_label}\n')  # Save the permuted line with labels of 0s, 1s and 2s
-
-                if logging:
-                    print('-----')
+    if profiler is not None:
+        profiler.stop()
+        print(profiler.write(args.profile_report, units=count_read - 1))
+        print(f'Profile report written to {args.profile_report}.')
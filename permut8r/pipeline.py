@@ -0,0 +1,336 @@
+import json
+import os
+
+import numpy as np
+
+from deleter import Deleter
+from eligibility import Eligibility
+from homophones import HOMOPHONE_INDEX_PATH, HomophoneIndex
+from inserter import Inserter
+from kanjiking import KanjiKing
+from reconstructor import Reconstructor
+from swapper import Swapper
+from vocab import VocabTable
+
+# Default resources, shared by everything that builds a pipeline
+TOKENIZER_NAME = 'cl-tohoku/bert-base-japanese-whole-word-masking'
+TAGGER_ARGS = '-r /dev/null -d /home/y4tsu/anaconda3/lib/python3.8/site-packages/unidic_lite/dicdir -Odump'
+KANJI_DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kanji-dictionary.json')
+FREQUENCY_LIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frequency-list.json')
+
+
+class Pipeline:
+    """
+    Takes a single correct line through the whole generation process: tokenize, roll the number of permutations, apply
+    them one at a time with reconstruction after each, and finally build the correct/permuted output pair. Owns the
+    permutator objects so that the generator script, the profiler and anything else driving lines through the process
+    all share exactly the same code path.
+
+    Params:
+    ------
+    rng: numpy default_rng() object:
+        random number generator that is shared across all the permutators
+    tokenizer: huggingface transformers pre-trained tokenizer object:
+        tokenizer object for converting strings into token lists, and token lists into de-tokenized string lists
+    tagger: MeCab tagger object:
+        the MeCab parser with correct dictionary selected and output format set to dump, shared across permutators
+    kanji_dictionary: dict:
+        a dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字)
+    frequency_dict: dict:
+        a dictionary with kanji as keys, and their frequency in JP Wikipedia as values
+    max_tok_length: int:
+        the token length of the output sequences
+    no_perm_probability: float:
+        the probability that a token will be left unaltered
+    homophones: HomophoneIndex or None:
+        the word-level homophone index for the KanjiKing, or None to only swap single kanji
+    logging: bool:
+        set to True to print logs for every step of the process
+    """
+    # Statuses returned by permutate() alongside the output pair
+    WRITTEN = 'WRITTEN'
+    NO_PERM = 'NO_PERM'
+    BAILED = 'BAILED'
+    BOGUS = 'BOGUS'
+
+    def __init__(self, rng, tokenizer, tagger, kanji_dictionary, frequency_dict, max_tok_length, no_perm_probability,
+                 homophones=None, logging=True):
+        """
+        Creates an instance of the Pipeline class, along with the permutators it drives.
+
+        Params:
+        ------
+        rng: numpy default_rng() object:
+            random number generator that is shared across all the permutators
+        tokenizer: huggingface transformers pre-trained tokenizer object:
+            tokenizer object for converting strings into token lists, and token lists into de-tokenized string lists
+        tagger: MeCab tagger object:
+            the MeCab parser with correct dictionary selected and output format set to dump, shared across permutators
+        kanji_dictionary: dict:
+            a dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字)
+        frequency_dict: dict:
+            a dictionary with kanji as keys, and their frequency in JP Wikipedia as values
+        max_tok_length: int:
+            the token length of the output sequences
+        no_perm_probability: float:
+            the probability that a token will be left unaltered
+        homophones: HomophoneIndex or None:
+            the word-level homophone index for the KanjiKing, or None to only swap single kanji
+        logging: bool:
+            set to True to print logs for every step of the process
+        """
+        self.rng = rng
+        self.tokenizer = tokenizer
+        self.max_tok_length = max_tok_length
+        self.no_perm_probability = no_perm_probability
+        self.logging = logging
+
+        self.swapper = Swapper(rng, logging=logging)
+        self.kk = KanjiKing(rng, tagger, kanji_dictionary, frequency_dict, homophones=homophones, logging=logging)
+        self.inserter = Inserter(rng, kanji_dictionary, frequency_dict, logging=logging)
+        self.deleter = Deleter(rng, logging=logging)
+
+        # Detokens are looked up from the ids already cleaned of #, so the permutators never need to clean them again
+        self.vocab = VocabTable(tokenizer, self.kk.katakana)
+        self.reconstructor = Reconstructor(tokenizer, self.vocab, max_tok_length, logging=False)
+        self.eligibility = Eligibility(rng, self.vocab, kanji_dictionary, self.kk.particles_short, homophones=homophones,
+                                       logging=logging)
+
+        # An OpTrace, if permutations should be traced
+        self.trace = None
+
+    @classmethod
+    def from_defaults(cls, rng, max_tok_length, no_perm_probability, logging=True):
+        """
+        Creates a pipeline with the default tokenizer, MeCab tagger, kanji dictionary and frequency list, plus the
+        homophone index if it has been built.
+        """
+        import MeCab
+        from transformers import BertJapaneseTokenizer
+
+        with open(KANJI_DICTIONARY_PATH, 'r') as kj:
+            # A dictionary with katakana readings as keys, and kanji with that reading as a list of values (常用漢字)
+            kanji_dictionary = json.loads(kj.read())
+        with open(FREQUENCY_LIST_PATH, 'r') as fl:
+            frequency_dict = json.loads(fl.read())
+
+        homophones = HomophoneIndex.load(HOMOPHONE_INDEX_PATH) if os.path.exists(HOMOPHONE_INDEX_PATH) else None
+
+        tagger = MeCab.Tagger(TAGGER_ARGS)
+        tokenizer = BertJapaneseTokenizer.from_pretrained(TOKENIZER_NAME)
+        return cls(rng, tokenizer, tagger, kanji_dictionary, frequency_dict, max_tok_length, no_perm_probability,
+                   homophones=homophones, logging=logging)
+
+    def set_rng(self, rng):
+        """ Swap the random number generator used by the pipeline and all of the permutators. """
+        self.rng = rng
+        for permutator in (self.swapper, self.kk, self.inserter, self.deleter, self.eligibility):
+            permutator.rng = rng
+
+    def encode(self, sentence):
+        """ Converts a sentence into it's tokenized output. Returns a dictionary with input_ids and attention_mask. """
+        return self.tokenizer.encode_plus(
+            sentence,
+            add_special_tokens=True,
+            max_length=self.max_tok_length,
+            padding='max_length',
+            return_attention_mask=True,
+            truncation=True
+        )
+
+    def lotto(self):
+        """ Eyyy step right up, step right up, get your lucky tickets here. Contains weightings for permutations. """
+        ticket_no = self.rng.uniform()
+
+        if ticket_no <= 0.15:
+            return 'SWAP'
+        elif ticket_no <= 0.45:
+            return 'DELETE'
+        elif ticket_no <= 0.75:
+            return 'INSERT'
+        else:
+            return 'KANJI'
+
+    def draw(self, detokens, num_valid_tokens):
+        """
+        Draw a ticket, and an index (plus the neighbour to swap with, for SWAP) that it is eligible for. The ticket is
+        never redrawn, so that the mix of permutations stays as weighted by lotto(). Returns (ticket, None, None) if the
+        ticket has no eligible position, and the roll is lost.
+        """
+        ticket = self.lotto()
+        return (ticket,) + self.eligibility.draw_index(ticket, detokens, num_valid_tokens)
+
+    def permutate(self, line):
+        """
+        Apply a random number of permutations to a single pre-cleaned line.
+
+        Params:
+        ------
+        line: str:
+            the correct line, stripped of whitespace and newlines
+
+        Returns:
+        -------
+        status: str:
+            one of WRITTEN, NO_PERM, BAILED or BOGUS, describing what happened to the line
+        pair: tuple or None:
+            (line, corr_label, new_line, new_label) strings ready to be written if the status is WRITTEN, else None
+        """
+        # TOKENIZE
+        return self.permutate_tokens(line, self.encode(line)['input_ids'])
+
+    def generate(self, line, line_id, prefilter=None):
+        """
+        Take one raw line of the input through pre-cleaning, the pre-filter and permutation, and trace it if a trace is
+        set. Both the single file loop of permut8.py and the ranges of jobs.py generate their lines through here.
+
+        Params:
+        ------
+        line: str:
+            the line as read from the input file
+        line_id: int:
+            the id that the line is traced with
+        prefilter: PreFilter or None:
+            if given, the lines that it rejects are skipped
+
+        Returns:
+        -------
+        status: str or None:
+            one of WRITTEN, NO_PERM, BAILED or BOGUS, or None if the pre-filter rejected the line
+        pair: tuple or None:
+            (line, corr_label, new_line, new_label) strings ready to be written with write_pair() if the status is
+            WRITTEN, else None
+        """
+        # PRE-CLEAN
+        line = line.strip().strip('\n')
+
+        # PRE-FILTER
+        if prefilter is not None and not prefilter.accept(line):
+            return None, None
+
+        # PERMUTATE
+        if self.trace is not None:
+            self.trace.start_line(line_id, line, self.rng)
+        status, pair = self.permutate(line)
+        if self.trace is not None:
+            self.trace.end_line(status)
+
+        if status == self.WRITTEN:
+            line, corr_label, new_line, new_label = pair
+            # Replace commas with JP commas to prevent CSV read errors
+            pair = (line.replace(',', '、'), corr_label, new_line.replace(',', '、'), new_label)
+        return status, pair
+
+    def permutate_tokens(self, line, tokens):
+        """
+        Apply a random number of permutations to a line that has already been tokenized.
+
+        Params:
+        ------
+        line: str:
+            the correct line, stripped of whitespace and newlines
+        tokens: list:
+            the input_ids of the line, padded to max_tok_length
+
+        Returns:
+        -------
+        status: str:
+            one of WRITTEN, NO_PERM, BAILED or BOGUS, describing what happened to the line
+        pair: tuple or None:
+            (line, corr_label, new_line, new_label) strings if the status is WRITTEN, else None
+        """
+        max_tok_length = self.max_tok_length
+
+        # DE-TOKENIZE, MAKE LABELS
+        detokens = self.vocab.detokens(tokens)
+        original_detokens = detokens.copy()
+        num_valid_tokens = self.vocab.count_valid(tokens)
+        corr_label = [0] + [1] * num_valid_tokens + (max_tok_length - 1 - num_valid_tokens) * [0]
+        err_label = corr_label.copy()
+
+        # ROLL
+        num_to_permutate = sum(np.where(self.rng.uniform(size=num_valid_tokens) > self.no_perm_probability, 1, 0))
+
+        if self.logging:
+            print(f'New line with {num_valid_tokens} valid tokens selected.')
+            print(f'Rolled {num_to_permutate} permutations.')
+
+        if num_to_permutate == 0:
+            if self.logging:
+                print('No permutation was drawn. :(')
+                print('-----')
+            return self.NO_PERM, None
+
+        if self.logging:
+            print(f'ORIGNL: {detokens}')
+
+        # PERMUTATE
+        for _ in range(num_to_permutate):
+            # Get your lucky ticket, and pick an index that it can be spent on
+            ticket, curr_index_to_permutate, neighbour = self.draw(detokens, num_valid_tokens)
+            if curr_index_to_permutate is None:
+                continue
+            if self.logging:
+                print(f'Ticket: Lucky ticket {ticket} rolled for {detokens[curr_index_to_permutate]} at index {curr_index_to_permutate}')
+
+            # Spend your ticket and update the detoks and err_label with the result
+            previous_detokens, previous_err_label = detokens.copy(), err_label.copy()
+            if ticket == 'SWAP':
+                detokens, err_label = self.swapper.swap(detokens, original_detokens, err_label, curr_index_to_permutate, num_valid_tokens, neighbour)
+            elif ticket == 'KANJI':
+                detokens, err_label = self.kk.kanji(detokens, err_label, curr_index_to_permutate)
+            elif ticket == 'INSERT':
+                detokens, err_label = self.inserter.insert(detokens, err_label, curr_index_to_permutate)
+            else:
+                detokens, err_label = self.deleter.delete(detokens, err_label, curr_index_to_permutate, num_valid_tokens)
+
+            if self.trace is not None:
+                self.trace.record(ticket, curr_index_to_permutate, previous_detokens[curr_index_to_permutate],
+                                  detokens[curr_index_to_permutate], err_label.count(2) - previous_err_label.count(2))
+
+            # Nothing to reconstruct if the permutator gave up (eg. the KanjiKing drew the same kanji)
+            if detokens == previous_detokens and err_label == previous_err_label:
+                continue
+
+            # If the detokens have all been deleted then exit here to prevent errors (unlikely but possible)
+            if (detokens == ['CLS'] + [''] + ['SEP'] + (['PAD'] * (max_tok_length - 3))) \
+                    or (detokens == ['CLS'] + (['SEP'] * 2) + (['PAD'] * (max_tok_length - 3))):
+                if self.logging:
+                    print(f'Detokens {detokens} was empty and so line {line} was bailed.')
+                return self.BAILED, None
+
+            # Reconstruct the line, then split again into de-tokens and update the label accordingly
+            result = self.reconstructor.reconstruct_line(detokens, err_label, num_valid_tokens)
+            if not result:
+                if self.logging:
+                    print(f'Bailing at error ... ')
+                return self.BAILED, None
+            else:
+                detokens, err_label, num_valid_tokens = result
+                if self.logging:
+                    print(f'DETOKS: {detokens}')
+                    print(f'ERR_LB: {err_label}')
+
+        # If the final detokens are the same as the original, it's a Bogus Transform™
+        if detokens == original_detokens:
+            if self.logging:
+                print(f'BOGUS TRANSFORM! Original and permuted detokens are the same.')
+            return self.BOGUS, None
+
+        # Otherwise all is good so build the 2 output lines
+        corr_label = "".join([str(x) for x in corr_label])
+        new_line = self.reconstructor.toks_to_line(detokens[1:1 + num_valid_tokens])
+        new_label = "".join([str(x) for x in err_label])
+        if self.logging:
+            print(f'OUTPUT: Original line: {line}')
+            print(f'OUTPUT: New line     : {new_line}')
+            print(f'OUTPUT: Correct label: {corr_label}')
+            print(f'OUTPUT: Error label  : {new_label}')
+        return self.WRITTEN, (line, corr_label, new_line, new_label)
+
+
+def write_pair(a, pair):
+    """ Writes a pair from Pipeline.generate() to an open file as two CSV lines. """
+    line, corr_label, new_line, new_label = pair
+    a.write(f'{line},{corr_label}\n')  # Save the original line with a label of all 0s and 1s
+    a.write(f'{new_line},{new_label}\n')  # Save the permuted line with labels of 0s, 1s and 2s
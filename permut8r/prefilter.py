@@ -0,0 +1,135 @@
+import re
+
+# Hiragana, katakana (incl. half-width and the prolonged sound mark), CJK ideographs, 々 and 〆
+JAPANESE_CHARACTERS = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f\u3005\u3006]')
+# Characters that Japanese text shares with other languages, so don't count towards the script ratio either way:
+# whitespace, digits (incl. full-width), ASCII punctuation, CJK punctuation such as 、。「」 and full-width forms
+NEUTRAL_CHARACTERS = re.compile(r'[\s\d!-/:-@\[-`{-~\u3000-\u3004\u3007-\u303f\uff01-\uff65]')
+
+# Patterns for lines that are markup or otherwise useless as training data, eg. from Wikipedia dumps
+DEFAULT_BLOCKLIST = [
+    r'https?://',           # URLs
+    r'<[^>]+>',             # HTML / XML tags
+    r'\{\{|\}\}|\[\[|\]\]',  # Wiki templates and links
+    r'^[=*#|!{};:]',        # Wiki headings, lists, tables
+    r'^\s*\W+\s*$',         # Punctuation only
+]
+
+
+class PreFilter:
+    """
+    A cheap set of checks that runs on each raw line before tokenization, so that the tokenizer and MeCab are only used
+    on lines that can produce a good pair. Lines are rejected by the first rule they fail, in this order:
+    1. empty: nothing left after stripping
+    2. too_short: fewer than min_chars characters
+    3. too_long: more than max_chars characters, ie. the line would be badly truncated to max_tok_length tokens
+    4. script_ratio: no kana or kanji, or less than min_japanese_ratio of the characters are kana or kanji, not counting
+       whitespace, digits, punctuation and full-width forms, eg. 2021年、COVID-19のワクチン接種が始まった。 passes
+    5. blocklist: the line matches one of the blocklist regex patterns
+    The number of lines rejected by each rule is kept in self.counts.
+
+    Params:
+    ------
+    min_chars: int:
+        the minimum number of characters a line must have
+    max_chars: int:
+        the maximum number of characters a line may have
+    min_japanese_ratio: float:
+        the minimum fraction of the non-neutral characters in the line that must be kana or kanji
+    blocklist: list or None:
+        regex pattern strings; lines matching any of them are rejected. Uses DEFAULT_BLOCKLIST if None
+    logging: bool:
+        set to True to print logs for every step of the process
+    """
+    RULES = ['empty', 'too_short', 'too_long', 'script_ratio', 'blocklist']
+
+    def __init__(self, min_chars=5, max_chars=120, min_japanese_ratio=0.5, blocklist=None, logging=True):
+        """
+        Creates an instance of the PreFilter class.
+
+        Params:
+        ------
+        min_chars: int:
+            the minimum number of characters a line must have
+        max_chars: int:
+            the maximum number of characters a line may have
+        min_japanese_ratio: float:
+            the minimum fraction of the non-neutral characters in the line that must be kana or kanji
+        blocklist: list or None:
+            regex pattern strings; lines matching any of them are rejected. Uses DEFAULT_BLOCKLIST if None
+        logging: bool:
+            set to True to print logs for every step of the process
+        """
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.min_japanese_ratio = min_japanese_ratio
+        self.blocklist = DEFAULT_BLOCKLIST if blocklist is None else blocklist
+        # One combined pattern is checked per line, the individual ones are only used to attribute a rejection
+        self.blocklist_patterns = [re.compile(pattern) for pattern in self.blocklist]
+        self.combined_blocklist = re.compile('|'.join(f'(?:{pattern})' for pattern in self.blocklist)) \
+            if self.blocklist else None
+        self.logging = logging
+
+        self.reset()
+
+    def reset(self):
+        """ Sets all of the counts back to 0. """
+        self.passed = 0
+        self.counts = {rule: 0 for rule in self.RULES}
+        self.blocklist_counts = {pattern: 0 for pattern in self.blocklist}
+
+    @staticmethod
+    def load_blocklist(path):
+        """ Reads a blocklist file with one regex pattern per line. Blank lines and lines starting with # are skipped. """
+        with open(path, 'r') as r:
+            return [line.rstrip('\n') for line in r if line.strip() and not line.startswith('#')]
+
+    def get_rejection(self, line):
+        """ Returns the name of the first rule that the (stripped) line fails, or None if it passes all of them. """
+        length = len(line)
+        if length == 0:
+            return 'empty'
+        if length < self.min_chars:
+            return 'too_short'
+        if length > self.max_chars:
+            return 'too_long'
+        num_japanese = len(JAPANESE_CHARACTERS.findall(line))
+        if num_japanese == 0 or \
+                num_japanese < self.min_japanese_ratio * (length - len(NEUTRAL_CHARACTERS.findall(line))):
+            return 'script_ratio'
+        if self.combined_blocklist is not None and self.combined_blocklist.search(line):
+            return 'blocklist'
+        return None
+
+    def get_blocked_pattern(self, line):
+        """ Returns the first blocklist pattern that matches the line. """
+        for pattern, compiled in zip(self.blocklist, self.blocklist_patterns):
+            if compiled.search(line):
+                return pattern
+
+    def accept(self, line):
+        """ Returns True if the line should be tokenized and permuted, and counts the result. """
+        rejection = self.get_rejection(line)
+        if rejection is None:
+            self.passed += 1
+            return True
+
+        self.counts[rejection] += 1
+        if rejection == 'blocklist':
+            self.blocklist_counts[self.get_blocked_pattern(line)] += 1
+        if self.logging:
+            print(f'FILTER: Rejected line by rule {rejection}: {line[:50]}')
+        return False
+
+    def report(self):
+        """ Returns a summary of how many lines passed, and how many each rule rejected. """
+        total = self.passed + sum(self.counts.values())
+        out = [f'{"Pre-filter passed:":<28}{self.passed:>12,}{100 * self.passed / max(1, total):>8.2f}%']
+        for rule in self.RULES:
+            out.append(f'{"  rejected " + rule + ":":<28}{self.counts[rule]:>12,}'
+                       f'{100 * self.counts[rule] / max(1, total):>8.2f}%')
+            if rule == 'blocklist':
+                for pattern, count in self.blocklist_counts.items():
+                    if count:
+                        out.append(f'{"    " + pattern[:22]:<28}{count:>12,}')
+        return '\n'.join(out)
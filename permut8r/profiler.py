@@ -0,0 +1,358 @@
+import cProfile
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+# The number of frames kept for each allocation, so it can be attributed to the nearest subsystem that made it
+MEMORY_FRAMES = 16
+
+# Subsystems that profile entries are grouped into. Each is matched in order against the source filename and function
+# name of an entry, and the first subsystem with a matching fragment wins. Functions that match none of them, eg. numpy
+# or builtins, are attributed to the nearest subsystem that called them, and only reported as 'other' if there is none.
+SUBSYSTEMS = [
+    ('pre-filter', ['prefilter.py']),
+    ('MeCab', ['MeCab', 'fugashi', 'unidic', 'ipadic']),
+    ('tokenizer', ['tokenization', 'tokenizers', 'convert_ids_to_tokens', 'encode_plus', 'vocab.py']),
+    ('permutators', ['deleter.py', 'inserter.py', 'kanjiking.py', 'homophones.py', 'swapper.py']),
+    ('reconstructor', ['reconstructor.py']),
+    ('eligibility', ['eligibility.py']),
+    ('pipeline', ['pipeline.py']),
+    ('model forward', ['torch', 'modeling_', 'activations.py']),
+    ('I/O', ['readline', "'write'", "'read'", 'codecs', '_io.', 'TextIOWrapper', 'builtins.print']),
+]
+
+
+def get_subsystem(filename, function_name=''):
+    """ Returns the name of the subsystem that a source file / function belongs to. """
+    for subsystem, fragments in SUBSYSTEMS:
+        for fragment in fragments:
+            if fragment in filename or fragment in function_name:
+                return subsystem
+    return 'other'
+
+
+def attribute_callers(stats):
+    """
+    Splits the time of every function in pstats data between subsystems. A function in a subsystem belongs to it
+    entirely. Any other function takes after its callers, weighted by the time it spent in calls from each of them,
+    which attributes it to the nearest subsystem up the call graph. Returns {function: {subsystem: fraction}}.
+    """
+    shares = {}
+    in_progress = set()
+
+    def get_shares(function):
+        if function in shares:
+            return shares[function]
+        subsystem = get_subsystem(function[0], function[2])
+        callers = stats[function][4] if function in stats else {}
+        if subsystem != 'other' or not callers or function in in_progress:
+            return shares.setdefault(function, {subsystem: 1.})
+
+        in_progress.add(function)
+        # Weight callers by the time spent in calls from them, or by the number of calls if no time was measured
+        weights = {caller: value[2] for caller, value in callers.items()}
+        if not sum(weights.values()):
+            weights = {caller: value[0] for caller, value in callers.items()}
+        total = sum(weights.values()) or 1.
+        result = defaultdict(float)
+        for caller, weight in weights.items():
+            for caller_subsystem, fraction in get_shares(caller).items():
+                result[caller_subsystem] += fraction * weight / total
+        in_progress.discard(function)
+        shares[function] = dict(result)
+        return shares[function]
+
+    for function in stats:
+        get_shares(function)
+    return shares
+
+
+def short_path(filename):
+    """ Trims site-packages and similar prefixes from a filename so report lines stay readable. """
+    if 'site-packages' + os.sep in filename:
+        return filename.split('site-packages' + os.sep, 1)[1]
+    if filename.startswith(os.path.dirname(os.__file__)):
+        return os.path.relpath(filename, os.path.dirname(os.__file__))
+    return os.path.basename(filename) if os.path.isabs(filename) else filename
+
+
+class Sampler:
+    """
+    A minimal sampling profiler. A SIGPROF timer interrupts the main thread every interval seconds of CPU time, and the
+    signal handler looks at the interrupted stack: the innermost frame gets self time and every frame on the stack gets
+    total time. Each sample is weighted by the wall time since the previous one, because Python only runs the handler
+    between bytecodes, so a long call into a C extension such as MeCab or torch shows up as one late, heavy sample in
+    the Python frame that made the call rather than being missed. Self time is kept per subsystem of the nearest frame
+    on the stack that belongs to one, so that eg. numpy called from the reconstructor counts towards the reconstructor.
+    Has a much lower overhead than cProfile. Only the main thread can be sampled, and only on platforms with setitimer.
+
+    Params:
+    ------
+    interval: float:
+        the number of seconds of CPU time between samples
+    """
+    def __init__(self, interval=0.005):
+        """
+        Creates an instance of the Sampler class.
+
+        Params:
+        ------
+        interval: float:
+            the number of seconds of CPU time between samples
+        """
+        self.interval = interval
+        self.self_seconds = defaultdict(float)  # Keyed by (function, subsystem)
+        self.total_seconds = defaultdict(float)
+        self.total_samples = defaultdict(int)
+        self.num_samples = 0
+        self._last_sample = None
+        self._previous_handler = None
+        self._subsystems = {}
+
+    def _get_subsystem(self, key):
+        try:
+            return self._subsystems[key]
+        except KeyError:
+            subsystem = self._subsystems[key] = get_subsystem(key[0], key[2])
+            return subsystem
+
+    def _handle(self, signum, frame):
+        now = time.perf_counter()
+        elapsed, self._last_sample = now - self._last_sample, now
+        if frame is None:
+            return
+        self.num_samples += 1
+        seen = set()
+        innermost = (frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name)
+        subsystem = 'other'
+        while frame is not None:
+            key = (frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name)
+            if subsystem == 'other':
+                subsystem = self._get_subsystem(key)
+            if key not in seen:
+                self.total_seconds[key] += elapsed
+                self.total_samples[key] += 1
+                seen.add(key)
+            frame = frame.f_back
+        self.self_seconds[(innermost, subsystem)] += elapsed
+
+    def start(self):
+        """ Start sampling. Must be called from the main thread, which is the thread that gets sampled. """
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError('The sampling profiler can only sample the main thread.')
+        self._last_sample = time.perf_counter()
+        self._previous_handler = signal.signal(signal.SIGPROF, self._handle)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """ Stop sampling and restore the previous SIGPROF handler. """
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+
+
+class Profiler:
+    """
+    Runs a block of code under cProfile or the sampling profiler, optionally together with tracemalloc, and builds a
+    per-function time and retained memory report grouped by subsystem (tokenizer, MeCab, permutators, reconstructor,
+    eligibility, pipeline, model forward, I/O). Use with start() and stop(), or as a context manager.
+
+    Params:
+    ------
+    mode: str:
+        'cprofile' for deterministic profiling of every call, or 'sample' for the low-overhead sampling profiler
+    memory: bool:
+        set to True to also trace allocations with tracemalloc (slows everything down, but roughly evenly)
+    interval: float:
+        the number of seconds between samples in 'sample' mode
+    """
+    def __init__(self, mode='cprofile', memory=True, interval=0.005):
+        """
+        Creates an instance of the Profiler class.
+
+        Params:
+        ------
+        mode: str:
+            'cprofile' for deterministic profiling of every call, or 'sample' for the low-overhead sampling profiler
+        memory: bool:
+            set to True to also trace allocations with tracemalloc (slows everything down, but roughly evenly)
+        interval: float:
+            the number of seconds between samples in 'sample' mode
+        """
+        if mode not in ('cprofile', 'sample'):
+            raise ValueError(f'Unknown profiling mode {mode}, expected cprofile or sample.')
+        self.mode = mode
+        self.memory = memory
+        self.interval = interval
+
+        self.profile = None
+        self.sampler = None
+        self.baseline = None
+        self.snapshot = None
+        self.peak_memory = 0
+        self.wall_time = 0.
+        self._start_time = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """ Start profiling the calling thread. """
+        if self.memory:
+            tracemalloc.start(MEMORY_FRAMES)
+            self.baseline = tracemalloc.take_snapshot()
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = Sampler(self.interval)
+            self.sampler.start()
+        self._start_time = time.perf_counter()
+
+    def stop(self):
+        """ Stop profiling and take the allocation snapshot that is compared to the one taken at the start. """
+        self.wall_time = time.perf_counter() - self._start_time
+        if self.mode == 'cprofile':
+            self.profile.disable()
+        else:
+            self.sampler.stop()
+        if self.memory:
+            # Leave out the allocations made by the profiler itself
+            self.snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, threading.__file__),
+            ])
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def _time_entries(self):
+        """
+        Returns a list of (subsystem, function description, self seconds, total seconds, calls) entries. A function
+        that is attributed to several subsystems has an entry in each, with its time split between them.
+        """
+        entries = []
+        if self.mode == 'cprofile':
+            stats = pstats.Stats(self.profile).stats
+            shares = attribute_callers(stats)
+            for function, (_, calls, tottime, cumtime, _) in stats.items():
+                filename, lineno, function_name = function
+                if filename == '~':
+                    description = function_name
+                else:
+                    description = f'{short_path(filename)}:{lineno}({function_name})'
+                for subsystem, fraction in shares[function].items():
+                    entries.append((subsystem, description, fraction * tottime, fraction * cumtime, calls))
+        else:
+            with_self_time = set()
+            for (key, subsystem), seconds in self.sampler.self_seconds.items():
+                filename, lineno, function_name = key
+                with_self_time.add(key)
+                description = f'{short_path(filename)}:{lineno}({function_name})'
+                entries.append((subsystem, description, seconds, self.sampler.total_seconds[key],
+                                self.sampler.total_samples[key]))
+            for key, seconds in self.sampler.total_seconds.items():
+                if key not in with_self_time:
+                    filename, lineno, function_name = key
+                    description = f'{short_path(filename)}:{lineno}({function_name})'
+                    entries.append((get_subsystem(filename, function_name), description, 0., seconds,
+                                    self.sampler.total_samples[key]))
+        return entries
+
+    def _memory_entries(self):
+        """
+        Returns a list of (subsystem, source line, bytes, blocks) entries for the memory that is still allocated at the
+        end of the run but wasn't at the start. Each allocation belongs to the nearest subsystem on its traceback, and
+        is listed under the source line that made it.
+        """
+        sizes = defaultdict(lambda: [0, 0])
+        for stat in self.snapshot.compare_to(self.baseline, 'traceback'):
+            if stat.size_diff <= 0:
+                continue
+            # Tracebacks are ordered from the most recent frame
+            subsystem = 'other'
+            for frame in stat.traceback:
+                subsystem = get_subsystem(frame.filename)
+                if subsystem != 'other':
+                    break
+            frame = stat.traceback[0]
+            entry = sizes[(subsystem, f'{short_path(frame.filename)}:{frame.lineno}')]
+            entry[0] += stat.size_diff
+            entry[1] += stat.count_diff
+        return [(subsystem, line, size, count) for (subsystem, line), (size, count) in sizes.items()]
+
+    def report(self, units=None, unit_name='lines', top=8):
+        """
+        Build the text report.
+
+        Params:
+        ------
+        units: int or None:
+            the number of lines or sentences processed while profiling, used to report per-unit costs
+        unit_name: str:
+            what the units are called in the report
+        top: int:
+            the number of functions / source lines to list for each subsystem
+
+        Returns:
+        -------
+        report: str:
+            the full report, ready to be printed or written to a file
+        """
+        out = [f'Profile mode: {self.mode}, wall time {self.wall_time:.2f}s']
+        if units:
+            out.append(f'Processed {units:,} {unit_name}, {units / self.wall_time:.1f} {unit_name}/s, '
+                       f'{1000 * self.wall_time / units:.3f} ms per {unit_name[:-1]}')
+
+        # Time, grouped by subsystem and sorted by self time
+        by_subsystem = defaultdict(list)
+        for entry in self._time_entries():
+            by_subsystem[entry[0]].append(entry)
+        subsystem_times = sorted(((sum(e[2] for e in v), k) for k, v in by_subsystem.items()), reverse=True)
+        total_self = sum(t for t, _ in subsystem_times) or 1.
+
+        out.append('')
+        out.append('==== TIME BY SUBSYSTEM (self time, attributed to the nearest subsystem on the stack) ====')
+        for self_time, subsystem in subsystem_times:
+            out.append(f'{subsystem:<16}{self_time:>10.3f}s {100 * self_time / total_self:>6.1f}%')
+        for self_time, subsystem in subsystem_times:
+            out.append('')
+            out.append(f'---- {subsystem} ----')
+            out.append(f'{"self (s)":>10}{"total (s)":>11}{"calls" if self.mode == "cprofile" else "samples":>11}  function')
+            for _, description, tottime, cumtime, calls in sorted(by_subsystem[subsystem], key=lambda e: -e[2])[:top]:
+                out.append(f'{tottime:>10.3f}{cumtime:>11.3f}{calls:>11,}  {description}')
+
+        if self.snapshot is not None:
+            by_subsystem = defaultdict(list)
+            for entry in self._memory_entries():
+                by_subsystem[entry[0]].append(entry)
+            subsystem_sizes = sorted(((sum(e[2] for e in v), k) for k, v in by_subsystem.items()), reverse=True)
+
+            out.append('')
+            out.append('==== MEMORY RETAINED BY THE RUN, BY SUBSYSTEM (tracemalloc, growth from start to end) ====')
+            out.append('Mostly caches and outputs: allocations freed before the end, eg. per-line temporaries, only '
+                       'count towards the peak.')
+            out.append(f'Peak traced memory: {self.peak_memory / 1024 / 1024:.1f} MiB')
+            for size, subsystem in subsystem_sizes:
+                out.append(f'{subsystem:<16}{size / 1024:>12.1f} KiB')
+            for size, subsystem in subsystem_sizes:
+                out.append('')
+                out.append(f'---- {subsystem} ----')
+                out.append(f'{"KiB":>12}{"blocks":>11}  source line')
+                for _, line, line_size, count in sorted(by_subsystem[subsystem], key=lambda e: -e[2])[:top]:
+                    out.append(f'{line_size / 1024:>12.1f}{count:>11,}  {line}')
+
+        return '\n'.join(out)
+
+    def write(self, path, units=None, unit_name='lines', top=8):
+        """ Build the report and write it to the given path. Returns the report. """
+        report = self.report(units, unit_name, top)
+        with open(path, 'w') as w:
+            w.write(report + '\n')
+        return report
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Reconstructor:
     """
     Turns detokens list into a string, tokenizes it again, and then re-creates the error label and undoes tokenization.
@@ -16,12 +19,14 @@ class Reconstructor:
     ------
     tokenizer: huggingface transformers pre-trained tokenizer object:
         tokenizer object for converting strings into token lists, and token lists into de-tokenized string lists
+    vocab: VocabTable:
+        the cleaned string, length and special flag of every token id, used to work from the ids of the retokenized line
     max_tok_length: int:
         the token length of the output sequences
     logging: bool:
         set to True to print logs for every step of the process
     """
-    def __init__(self, tokenizer, max_tok_length, logging=True):
+    def __init__(self, tokenizer, vocab, max_tok_length, logging=True):
         """
         Creates an instance of the Reconstructor class.
 
@@ -29,12 +34,16 @@ class Reconstructor:
         ------
         tokenizer: huggingface transformers pre-trained tokenizer object:
             tokenizer object for converting strings into token lists, and token lists into de-tokenized string lists
+        vocab: VocabTable:
+            the cleaned string, length and special flag of every token id, used to work from the ids of the retokenized
+            line
         max_tok_length: int:
             the token length of the output sequences
         logging: bool:
             set to True to print logs for every step of the process
         """
         self.tokenizer = tokenizer
+        self.vocab = vocab
         self.logging = logging
         self.max_tok_length = max_tok_length
 
@@ -51,21 +60,13 @@ class Reconstructor:
 
     @staticmethod
     def toks_to_line(toks):
-        """ Recombines tokens into a string. """
-        return ''.join(toks).replace('#', '')
+        """ Recombines cleaned detokens into a string. """
+        return ''.join(toks)
 
     @staticmethod
     def expand_labels(detoks, labels):
-        """ Expands a label to the length of each token. """
-        result = ''
-        for detok, label in zip(detoks, labels):
-            result += str(label) * len(detok.replace('#', ''))
-        return result
-
-    @staticmethod
-    def get_tok_lengths(detoks):
-        """ Get the length of every detoken as save as a list. """
-        return [(len(detok.replace('#', ''))) for detok in detoks]
+        """ Expands a label to the length of each cleaned detoken. """
+        return ''.join([str(label) * len(detok) for detok, label in zip(detoks, labels)])
 
     @staticmethod
     def get_tok_length_indices(detok_lengths):
@@ -73,31 +74,18 @@ class Reconstructor:
         Get the increasing index of every detoken length for use as a reference.
         Note that each value indicates a range(indices[i], indices[i + 1]) which applies to a detoken.
         """
-        try:
-            result = [detok_lengths[0]]
-        except IndexError:
-            print(detok_lengths)
-            raise Exception
-        for i, length in enumerate(detok_lengths[1:]):
-            result.append(length + result[i])
-        return result
+        return np.cumsum(detok_lengths)
 
     @staticmethod
     def repaint_labels(error_indices, retok_length_indices):
         """ Fill labels in the new, correct place for the valid portion of the label. """
         result = [1] * len(retok_length_indices)
-        for error_index in error_indices:
-            for i, tok_index in enumerate(retok_length_indices):
-                if tok_index > error_index:
-                    result[i] = 2
-                    break
+        # The token of each error is the first one whose end index is past it
+        for i in np.searchsorted(retok_length_indices, error_indices, side='right'):
+            if i < len(result):
+                result[i] = 2
         return result
 
-    @staticmethod
-    def count_non_bert_tokens(total, tokens):
-        # Counts the number of valid tokens which aren't CLS, PAD or SEP
-        return total - (sum([x in [0, 2, 3] for x in tokens]))
-
     def reconstruct_line(self, detoks, err_label, num_valid):
         """ Given an input line and label, converts back to a sentence, then re-tokenizes and reallocates labels. """
         if self.logging:
@@ -112,8 +100,8 @@ class Reconstructor:
             print(f'        ReX: ERRORIDX : {error_indices}')
 
         tokens = self.encode_to_ids(line)
-        num_valid_retokens = self.count_non_bert_tokens(self.max_tok_length, tokens)
-        retokens = self.tokenizer.convert_ids_to_tokens(tokens)
+        num_valid_retokens = self.vocab.count_valid(tokens)
+        retokens = self.vocab.detokens(tokens)
 
         if num_valid_retokens == 0:
             # Issue can arise if eg. all tokens get deleted in the sentence
@@ -125,7 +113,7 @@ class Reconstructor:
             print(f'        ReX: reTOKENS : {retokens}')
             print(f'        ReX: VALIDS   : Previously: {num_valid}, now: {num_valid_retokens}')
 
-        retok_lengths = self.get_tok_lengths(retokens[1:1 + num_valid_retokens])
+        retok_lengths = self.vocab.lengths_of(tokens[1:1 + num_valid_retokens])
         retok_length_indices = self.get_tok_length_indices(retok_lengths)
         if self.logging:
             print(f'        ReX: LENGTHS  : {retok_lengths}')
@@ -0,0 +1,169 @@
+import json
+import os
+
+import numpy as np
+
+
+class ShardWriter:
+    """
+    Writes output pairs into one shard per length bucket instead of a single file, so that training batches can be
+    built from sentences of similar length and padded tightly. A pair goes into the smallest bucket that fits the
+    longer of its two sentences, counted in tokens including CLS and SEP. Next to each shard, an index file holds the
+    byte offset of every pair as uint64, and a JSON summary of all the buckets is written on close().
+
+    Params:
+    ------
+    output_prefix: str:
+        path prefix of the shards, eg. 'permutations' gives permutations-len01-16.txt, permutations-len17-24.txt, ...
+    buckets: list:
+        the upper bound of each bucket in tokens, in increasing order. The last must be max_tok_length
+    max_tok_length: int:
+        the token length of the output sequences
+    """
+    def __init__(self, output_prefix, buckets, max_tok_length):
+        """
+        Creates an instance of the ShardWriter class.
+
+        Params:
+        ------
+        output_prefix: str:
+            path prefix of the shards, eg. 'permutations' gives permutations-len01-16.txt, permutations-len17-24.txt, ...
+        buckets: list:
+            the upper bound of each bucket in tokens, in increasing order. The last must be max_tok_length
+        max_tok_length: int:
+            the token length of the output sequences
+        """
+        if list(buckets) != sorted(buckets) or buckets[-1] != max_tok_length:
+            raise ValueError(f'Buckets {buckets} must be increasing and end with max_tok_length {max_tok_length}.')
+        self.output_prefix = output_prefix
+        self.buckets = list(buckets)
+        self.max_tok_length = max_tok_length
+
+        # Look up table from sequence length to bucket number
+        self.bucket_of_length = np.searchsorted(self.buckets, np.arange(max_tok_length + 1))
+
+        self.paths = []
+        self.files = []
+        self.index_files = []
+        self.offsets = [0] * len(self.buckets)
+        self.counts = [0] * len(self.buckets)
+        for low, high in zip([1] + [b + 1 for b in self.buckets[:-1]], self.buckets):
+            path = f'{output_prefix}-len{low:02d}-{high:02d}.txt'
+            self.paths.append(path)
+            self.files.append(open(path, 'wb'))
+            self.index_files.append(open(path[:-len('.txt')] + '.idx', 'wb'))
+
+    def write(self, line, corr_label, new_line, new_label):
+        """ Writes a pair into the shard for its length, and its offset into the shard's index. """
+        # Every label is 0 apart from the CLS, valid tokens and SEP
+        seq_length = min(self.max_tok_length, 2 + max(corr_label.count('1'), len(new_label) - new_label.count('0')))
+        bucket = self.bucket_of_length[seq_length]
+
+        data = f'{line},{corr_label}\n{new_line},{new_label}\n'.encode('utf-8')
+        self.files[bucket].write(data)
+        self.index_files[bucket].write(np.uint64(self.offsets[bucket]).tobytes())
+        self.offsets[bucket] += len(data)
+        self.counts[bucket] += 1
+
+    def close(self):
+        """ Closes every shard and writes the JSON summary. Returns the path of the summary. """
+        for f in self.files + self.index_files:
+            f.close()
+        summary = {
+            'max_tok_length': self.max_tok_length,
+            'buckets': [{'max_length': high, 'path': os.path.abspath(path),
+                         'index': os.path.abspath(path[:-len('.txt')] + '.idx'), 'pairs': count}
+                        for high, path, count in zip(self.buckets, self.paths, self.counts)],
+        }
+        summary_path = f'{self.output_prefix}-buckets.json'
+        with open(summary_path, 'w') as w:
+            json.dump(summary, w, indent=1)
+        return summary_path
+
+    def report(self):
+        """ Returns the number of pairs written to each bucket. """
+        total = max(1, sum(self.counts))
+        return '\n'.join(f'{"  <= " + str(high) + " tokens:":<18}{count:>12,}{100 * count / total:>8.2f}%'
+                         for high, count in zip(self.buckets, self.counts))
+
+
+class BucketSampler:
+    """
+    Yields batches of pairs that all come from the same length bucket, so each batch only needs padding up to its
+    bucket's max_length. The bucket of each batch is drawn at random with the given weights, which by default are the
+    number of pairs in each bucket, preserving the overall length distribution of the data. Within a bucket, pairs are
+    visited in a freshly shuffled order every time the bucket is used up.
+
+    Each batch is a dictionary of:
+    path: the shard the pairs are in
+    offsets: the byte offsets of the pairs, which can be read with load_pairs()
+    pad_length: the max_length of the bucket
+
+    Params:
+    ------
+    summary_path: str:
+        the JSON summary written by ShardWriter.close()
+    batch_size: int:
+        the number of pairs in each batch
+    weights: list or None:
+        the relative probability of drawing a batch from each bucket, defaults to the number of pairs in each
+    seed: int or None:
+        seed for the random number generator
+    """
+    def __init__(self, summary_path, batch_size, weights=None, seed=None):
+        """
+        Creates an instance of the BucketSampler class.
+
+        Params:
+        ------
+        summary_path: str:
+            the JSON summary written by ShardWriter.close()
+        batch_size: int:
+            the number of pairs in each batch
+        weights: list or None:
+            the relative probability of drawing a batch from each bucket, defaults to the number of pairs in each
+        seed: int or None:
+            seed for the random number generator
+        """
+        with open(summary_path, 'r') as r:
+            self.buckets = [bucket for bucket in json.load(r)['buckets'] if bucket['pairs'] > 0]
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.offsets = [np.fromfile(bucket['index'], dtype=np.uint64) for bucket in self.buckets]
+
+        if weights is None:
+            weights = [bucket['pairs'] for bucket in self.buckets]
+        weights = np.asarray(weights, dtype=np.float64)
+        self.probabilities = weights / weights.sum()
+
+    def __len__(self):
+        """ The number of batches in one epoch, ie. roughly one pass over every pair. """
+        return sum(len(offsets) for offsets in self.offsets) // self.batch_size
+
+    def __iter__(self):
+        orders = [self.rng.permutation(len(offsets)) for offsets in self.offsets]
+        positions = [0] * len(self.buckets)
+        for bucket in self.rng.choice(len(self.buckets), size=len(self), p=self.probabilities):
+            # Reshuffle a bucket once it has been used up
+            if positions[bucket] + self.batch_size > len(orders[bucket]):
+                orders[bucket] = self.rng.permutation(len(self.offsets[bucket]))
+                positions[bucket] = 0
+            selected = orders[bucket][positions[bucket]:positions[bucket] + self.batch_size]
+            positions[bucket] += self.batch_size
+            yield {
+                'path': self.buckets[bucket]['path'],
+                'offsets': self.offsets[bucket][selected],
+                'pad_length': self.buckets[bucket]['max_length'],
+            }
+
+
+def load_pairs(path, offsets):
+    """ Reads the pairs at the given byte offsets of a shard. Returns a list of (line, corr_label, new_line, new_label). """
+    pairs = []
+    with open(path, 'rb') as r:
+        for offset in offsets:
+            r.seek(int(offset))
+            line, corr_label = r.readline().decode('utf-8').rstrip('\n').rsplit(',', 1)
+            new_line, new_label = r.readline().decode('utf-8').rstrip('\n').rsplit(',', 1)
+            pairs.append((line, corr_label, new_line, new_label))
+    return pairs
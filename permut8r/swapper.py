@@ -1,6 +1,7 @@
 class Swapper:
     """
-    The swapper swaps 2 tokens with each other. A choice whether to swap left or right is made randomly, except for
+    The swapper swaps 2 tokens with each other. The neighbour to swap with is normally drawn by the Eligibility, so that
+    it is never identical to the token. Without one, a choice whether to swap left or right is made randomly, except for
     tokens at the start or end of the sentence, which can only be swapped with the token next to them.
 
     Params:
@@ -24,7 +25,7 @@ class Swapper:
         self.rng = rng
         self.logging = logging
 
-    def swap(self, detokens, original_detokens, err_label, index, num_valid_tokens):
+    def swap(self, detokens, original_detokens, err_label, index, num_valid_tokens, neighbour=None):
         """
         Swaps tokens and returns the permuted list of tokens.
 
@@ -40,6 +41,8 @@ class Swapper:
             the index of the token to be permuted
         num_valid_tokens: int:
             the number of non-padding, non-EOS, non-CLS etc. tokens in the string
+        neighbour: int or None:
+            the index to swap with, either index - 1 or index + 1, or None to choose one randomly
 
         Returns:
         -------
@@ -51,8 +54,16 @@ class Swapper:
         if self.logging:
             print(f'SWAP  : Swapping index {index} of {num_valid_tokens}')
 
+        # With the neighbour that was drawn
+        if neighbour is not None:
+            detokens[index], detokens[neighbour] = detokens[neighbour], detokens[index]
+            err_label[index] = 2
+            err_label[neighbour] = 2
+            if self.logging:
+                print(f'{"sLEFT " if neighbour < index else "sRIGHT"}: {detokens}')
+
         # At start of sentence
-        if index == 1:
+        elif index == 1:
             detokens[1], detokens[2] = detokens[2], detokens[1]
             err_label[1] = 2
             err_label[2] = 2
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class VocabTable:
+    """
+    Tables indexed by token id, built once from the tokenizer, so that the pipeline can look up what it needs about a
+    token instead of converting ids to strings and cleaning them again at every step:
+    cleaned: the token string with the # of word pieces removed, eg. ##くる -> くる
+    lengths: the number of characters in each cleaned token
+    special: True for the CLS, SEP, PAD and MASK tokens, which are not part of the sentence (UNK is)
+    script: bit flags of the scripts that appear in each cleaned token, 0 for an empty token
+
+    Script classes, stored as bit flags:
+    HIRAGANA: hiragana characters
+    KATAKANA: characters of the KanjiKing's katakana, including ー
+    KANJI: CJK ideographs, or 々 / 〆
+    PUNCTUATION: EOS punctuation
+    OTHER: anything else, eg. latin letters, digits or other symbols
+
+    Params:
+    ------
+    tokenizer: huggingface transformers pre-trained tokenizer object:
+        tokenizer object for converting strings into token lists, and token lists into de-tokenized string lists
+    katakana: str:
+        all the katakana characters, as used by the KanjiKing
+    """
+    HIRAGANA = 1
+    KATAKANA = 2
+    KANJI = 4
+    PUNCTUATION = 8
+    OTHER = 16
+
+    def __init__(self, tokenizer, katakana):
+        """
+        Creates an instance of the VocabTable class.
+
+        Params:
+        ------
+        tokenizer: huggingface transformers pre-trained tokenizer object:
+            tokenizer object for converting strings into token lists, and token lists into de-tokenized string lists
+        katakana: str:
+            all the katakana characters, as used by the KanjiKing
+        """
+        self.katakana = set(katakana)
+
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        self.cleaned = [token.replace('#', '') for token in tokens]
+        self.lengths = np.array([len(token) for token in self.cleaned], dtype=np.int32)
+        self.special = np.zeros(len(tokens), dtype=bool)
+        self.special[[tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id,
+                      tokenizer.mask_token_id]] = True
+        self.script = np.array([self.script_of(token) for token in self.cleaned], dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.cleaned)
+
+    @staticmethod
+    def is_kanji(character):
+        """ Whether a character is a CJK ideograph, or 々 / 〆. """
+        return '\u4e00' <= character <= '\u9fff' or '\u3400' <= character <= '\u4dbf' or character in '々〆'
+
+    def script_of(self, string):
+        """ Returns the script bit flags of any cleaned string, eg. a detoken that has been permuted. """
+        script = 0
+        for character in string:
+            if '\u3041' <= character <= '\u309f':
+                script |= self.HIRAGANA
+            elif character in self.katakana:
+                script |= self.KATAKANA
+            elif self.is_kanji(character):
+                script |= self.KANJI
+            elif character in '。！？!?.':
+                script |= self.PUNCTUATION
+            else:
+                script |= self.OTHER
+        return script
+
+    def detokens(self, ids):
+        """ Converts a list of input_ids into cleaned detokens. """
+        cleaned = self.cleaned
+        return [cleaned[i] for i in ids]
+
+    def count_valid(self, ids):
+        """ Counts the number of valid tokens, which aren't CLS, PAD or SEP. """
+        return len(ids) - int(self.special[ids].sum())
+
+    def lengths_of(self, ids):
+        """ Returns the number of characters in each cleaned token as an array. """
+        return self.lengths[ids]
@@ -0,0 +1,136 @@
+import re
+from difflib import SequenceMatcher
+
+from check import check_batch, tokenizer
+
+SPECIAL_TOKENS = set(tokenizer.all_special_tokens)
+
+# A sentence runs up to and including its end punctuation, or up to a line break
+SENTENCE = re.compile(r'[^。！？!?\n]+[。！？!?]*|[。！？!?]+')
+
+
+def split_sentences(text):
+    """ Splits text into sentences. Returns a list of (start, end) character offsets, excluding whitespace. """
+    spans = []
+    for match in SENTENCE.finditer(text):
+        sentence = match.group()
+        stripped = sentence.strip()
+        if stripped:
+            start = match.start() + sentence.index(stripped)
+            spans.append((start, start + len(stripped)))
+    return spans
+
+
+def locate_tokens(sentence, detokens):
+    """ Finds the (start, end) character offsets of each detoken in the sentence, or None for tokens not found in it. """
+    spans = []
+    cursor = 0
+    for detoken in detokens:
+        piece = detoken.replace('#', '')
+        position = sentence.find(piece, cursor) if piece and detoken not in SPECIAL_TOKENS else -1
+        if position == -1:
+            spans.append(None)
+        else:
+            spans.append((position, position + len(piece)))
+            cursor = position + len(piece)
+    return spans
+
+
+class CheckSession:
+    """
+    Keeps the results of checking a document, so that when the user edits it and checks again, only the sentences that
+    changed are passed through the model. The new text is split into sentences and diffed against the previous version;
+    unchanged sentences keep their cached results, and the changed ones are checked together in one batch. Results are
+    kept relative to the start of each sentence, so cached labels are simply moved to the sentence's new offset.
+
+    Each sentence result is a dictionary of:
+    start, end: the character offsets of the sentence in the current text
+    text: the sentence
+    detokens: the model's tokens for the sentence
+    predictions: the 0, 1 or 2 label predicted for each token
+    spans: the (start, end) character offsets of each token relative to the sentence start, or None if not found
+
+    Params:
+    ------
+    batch_size: int:
+        the maximum number of sentences passed through the model at once
+    """
+    def __init__(self, batch_size=64):
+        """
+        Creates an instance of the CheckSession class.
+
+        Params:
+        ------
+        batch_size: int:
+            the maximum number of sentences passed through the model at once
+        """
+        self.batch_size = batch_size
+        self.text = ''
+        self.sentences = []
+        self.last_rechecked = 0
+
+    def check_sentences(self, sentences):
+        """ Checks a list of sentences in batches, and returns a result dictionary for each. """
+        results = []
+        for i in range(0, len(sentences), self.batch_size):
+            batch = sentences[i:i + self.batch_size]
+            input_ids, predictions = check_batch(batch)
+            for sentence, ids, preds in zip(batch, input_ids, predictions):
+                detokens = tokenizer.convert_ids_to_tokens(ids)
+                results.append({
+                    'text': sentence,
+                    'detokens': detokens,
+                    'predictions': preds,
+                    'spans': locate_tokens(sentence, detokens),
+                })
+        return results
+
+    def update(self, text):
+        """
+        Check a new version of the document, re-running only the sentences that changed since the previous version.
+
+        Params:
+        ------
+        text: str:
+            the full, edited text of the document
+
+        Returns:
+        -------
+        sentences: list:
+            a result dictionary for every sentence in the text, in order
+        """
+        offsets = split_sentences(text)
+        new_texts = [text[start:end] for start, end in offsets]
+        old_texts = [sentence['text'] for sentence in self.sentences]
+
+        # Keep the results of unchanged sentences, and collect the changed ones to check in one batch
+        results = [None] * len(new_texts)
+        to_check = []
+        matcher = SequenceMatcher(None, old_texts, new_texts, autojunk=False)
+        for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+            if tag == 'equal':
+                for old_index, new_index in zip(range(old_start, old_end), range(new_start, new_end)):
+                    results[new_index] = dict(self.sentences[old_index])
+            else:
+                to_check.extend(range(new_start, new_end))
+
+        for index, result in zip(to_check, self.check_sentences([new_texts[index] for index in to_check])):
+            results[index] = result
+
+        # Move every result to its sentence's offset in the new text
+        for result, (start, end) in zip(results, offsets):
+            result['start'], result['end'] = start, end
+
+        self.text = text
+        self.sentences = results
+        self.last_rechecked = len(to_check)
+        return results
+
+    def errors(self):
+        """ Returns (start, end, token) for every token predicted as an error, with offsets in the current text. """
+        errors = []
+        for sentence in self.sentences:
+            for detoken, prediction, span in zip(sentence['detokens'], sentence['predictions'], sentence['spans']):
+                if prediction == 2 and span is not None:
+                    errors.append((sentence['start'] + span[0], sentence['start'] + span[1], detoken))
+        return errors